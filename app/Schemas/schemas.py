@@ -1,3 +1,4 @@
+from datetime import date
 from pydantic import BaseModel
 
 
@@ -14,6 +15,14 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserUpdate(BaseModel):
+    username: str | None = None
+    password: str | None = None
+
+class UserPage(BaseModel):
+    items: list[User]
+    next_cursor: str | None = None
+
 class UserWithToken(BaseModel):
     user: User
     access_token: str
@@ -38,6 +47,27 @@ class Product(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductUpdate(BaseModel):
+    name: str | None = None
+    description: str | None = None
+    price: float | None = None
+    stock: int | None = None
+
+class ProductPage(BaseModel):
+    items: list[Product]
+    next_cursor: str | None = None
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ProductImportResult(BaseModel):
+    received: int
+    upserted: int
+    errors: list[ImportRowError]
+    seconds: float
+    rows_per_second: float
+
 # CartItem Schemas
 class CartItemBase(BaseModel):
     quantity: int
@@ -53,20 +83,77 @@ class CartItem(CartItemBase):
     class Config:
         from_attributes = True
 
+class CartItemUpdate(BaseModel):
+    quantity: int | None = None
+    product_id: int | None = None
+
+class CartItemPage(BaseModel):
+    items: list[CartItem]
+    next_cursor: str | None = None
+
+class CartLine(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    name: str
+    unit_price: float
+    stock: int
+    line_total: float
+
+class CartView(BaseModel):
+    user_id: int
+    items: list[CartLine]
+    item_count: int
+    total_price: float
+
 # Purchase Schemas
 class PurchaseBase(BaseModel):
     total_price: float
 
 class PurchaseCreate(PurchaseBase):
-    pass
+    product_id: int | None = None
+    quantity: int = 1
 
 class Purchase(PurchaseBase):
     id: int
     user_id: int
+    product_id: int | None = None
+    quantity: int = 1
 
     class Config:
         from_attributes = True
 
+class PurchaseUpdate(BaseModel):
+    total_price: float | None = None
+    quantity: int | None = None
+
+class PurchasePage(BaseModel):
+    items: list[Purchase]
+    next_cursor: str | None = None
+
+class CheckoutResult(BaseModel):
+    purchases: list[Purchase]
+    total_price: float
+
+# Sales report Schemas
+class ProductSales(BaseModel):
+    product_id: int
+    units: int
+    revenue: float
+    purchases: int
+
+class UserSpend(BaseModel):
+    user_id: int
+    units: int
+    revenue: float
+    purchases: int
+
+class DailySales(BaseModel):
+    day: date
+    units: int
+    revenue: float
+    purchases: int
+
 # Token Schema
 class Token(BaseModel):
     access_token: str
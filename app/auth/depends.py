@@ -1,14 +1,17 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
-import service.crud as crud
-import Models.models as models
-from service.database import sessionlocal
-from passlib.context import CryptContext
+import service.async_crud as async_crud
+import service.database as database
+import Auth.hashing as hashing
+import Schemas.schemas as schemas
+from service.cache import TTLCache
 import os
 from datetime import timezone, datetime, timedelta
 from typing import Annotated 
+from contextlib import asynccontextmanager
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,45 +20,83 @@ secret_key = str(os.getenv('SECRET_KEY'))
 algorithm = str(os.getenv('ALGORITHM'))
 access_token_expire = int(400)
 
+# resolved principals keyed by token subject; TRUST_TOKEN_CLAIMS skips the
+# database entirely and builds the user from the signed sub/uid claims
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 60))
+)
+trust_token_claims = os.getenv('TRUST_TOKEN_CLAIMS', 'false').lower() in ('1', 'true', 'yes')
+
+# after a write, reads with the same token go to the primary for a while so
+# the client sees its own writes despite replica lag
+read_pins = TTLCache(maxsize=100000, ttl=float(os.getenv('REPLICA_PIN_SECONDS', 5)))
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")  
 
-def get_db():
-    db = sessionlocal()
+def pin_key(request: Request):
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return None
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+@asynccontextmanager
+async def session_scope(factory):
+    if database.use_async:
+        async with factory() as db:
+            yield db
+        return
+    db = factory()
     try:
         yield db
     finally:
         db.close()
 
-def verify_password(plain_password, hashed_password):
-    logging.debug("verifying password")
-    return bcrypt_context.verify(plain_password, hashed_password)
+async def get_db(request: Request):
+    key = pin_key(request)
+    if key is not None and request.method not in ("GET", "HEAD"):
+        read_pins.set(key, True)
+    async with session_scope(database.get_write_sessionlocal()) as db:
+        yield db
+
+async def get_read_db(request: Request):
+    key = pin_key(request)
+    if key is not None and read_pins.get(key):
+        factory = database.get_write_sessionlocal()
+    else:
+        factory = database.get_read_sessionlocal()
+    async with session_scope(factory) as db:
+        yield db
 
-def get_password_hash(password):
-    logging.debug("hashing password")
-    return bcrypt_context.hash(password)
+verify_password = hashing.verify_password
+get_password_hash = hashing.get_password_hash
 
 def create_access_token(data: dict):
-    logging.info("Creating access token")
+    logger.info("Creating access token")
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=access_token_expire)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, secret_key, algorithm=algorithm)
     return encoded_jwt
 
-def get_user(db: Session, username: str):
-    logging.info(f"Getting user:{username}")
-    return crud.get_user_by_username(db, username)
+async def get_user(db: Session, username: str):
+    logger.info("Getting user:%s", username)
+    return await async_crud.get_user_by_username(db, username)
 
-def authenticate_user(db: Session, username: str, password: str):
-    logging.info(f"Authenticating user:{username}")
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user and verify_password(password, user.hashed_password):
+async def authenticate_user(db: Session, username: str, password: str):
+    logger.info("Authenticating user:%s", username)
+    user = await async_crud.get_user_by_username(db, username)
+    if user and await hashing.verify_password_async(password, user.hashed_password):
         return user
-    logging.info(f"Authentication failed for user:{username}")
+    logger.info("Authentication failed for user:%s", username)
     return None
 
+def invalidate_user(user_id: int):
+    user_cache.delete_where(lambda user: user.id == user_id)
+
+def get_user_cache_stats():
+    return user_cache.stats()
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)):
     exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -68,8 +109,15 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Se
             raise exception
     except JWTError:
         raise exception
-    user = get_user(db, username)
-    if user is None:
+    if trust_token_claims and payload.get("uid") is not None:
+        return schemas.User(id=payload["uid"], username=username)
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    db_user = await get_user(db, username)
+    if db_user is None:
         raise exception
-    logging.info(f"currect user: {username}")
+    user = schemas.User.model_validate(db_user)
+    user_cache.set(username, user)
+    logger.info("currect user: %s", username)
     return user
\ No newline at end of file
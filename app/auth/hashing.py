@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from passlib.context import CryptContext
+import asyncio
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# bcrypt takes hundreds of milliseconds per call, so it is kept off the event
+# loop. HASH_POOL picks "thread" (bcrypt releases the GIL) or "process".
+hash_pool = os.getenv('HASH_POOL', 'thread').lower()
+hash_workers = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+hash_max_concurrency = int(os.getenv('HASH_MAX_CONCURRENCY', hash_workers))
+
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_executor = None
+_semaphore = None
+_stats = {"waiting": 0, "running": 0, "completed": 0, "max_waiting": 0}
+
+def verify_password(plain_password, hashed_password):
+    logger.debug("verifying password")
+    return bcrypt_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    logger.debug("hashing password")
+    return bcrypt_context.hash(password)
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if hash_pool == "process":
+            _executor = ProcessPoolExecutor(max_workers=hash_workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="bcrypt")
+        logger.info("Started %s pool with %s workers for password hashing", hash_pool, hash_workers)
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def _run(func, *args):
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(hash_max_concurrency)
+    _stats["waiting"] += 1
+    _stats["max_waiting"] = max(_stats["max_waiting"], _stats["waiting"])
+    queued = True
+    try:
+        async with _semaphore:
+            _stats["waiting"] -= 1
+            queued = False
+            _stats["running"] += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(get_executor(), func, *args)
+            finally:
+                _stats["running"] -= 1
+                _stats["completed"] += 1
+    finally:
+        if queued:
+            _stats["waiting"] -= 1
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run(get_password_hash, password)
+
+def queue_depth():
+    return _stats["waiting"]
+
+def get_stats():
+    return dict(_stats, workers=hash_workers, max_concurrency=hash_max_concurrency, pool=hash_pool)
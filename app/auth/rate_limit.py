@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import math
+import os
+import threading
+import time
+
+# Token buckets for /token, one per username and one per client IP. The
+# in-memory backend is per worker; set_backend() swaps in a shared store.
+#
+#   LOGIN_USER_RATE / LOGIN_USER_BURST  attempts per minute / burst per username
+#   LOGIN_IP_RATE / LOGIN_IP_BURST      attempts per minute / burst per client IP
+#   LOGIN_MAX_QUEUE                     verifications allowed to wait for the hashing pool
+#   LOGIN_CLIENT_IP_HEADER              header the reverse proxy puts the client address in
+#
+# Behind a reverse proxy every request comes from the proxy's address, so
+# the per-IP bucket would be shared by all clients. Set
+# LOGIN_CLIENT_IP_HEADER (e.g. X-Forwarded-For) when the app is only
+# reachable through a proxy that sets it; the last address in the header is
+# the one the proxy saw. Without it the socket peer address is used.
+
+user_rate = float(os.getenv('LOGIN_USER_RATE', 5)) / 60
+user_burst = float(os.getenv('LOGIN_USER_BURST', 5))
+ip_rate = float(os.getenv('LOGIN_IP_RATE', 60)) / 60
+ip_burst = float(os.getenv('LOGIN_IP_BURST', 20))
+max_queue = int(os.getenv('LOGIN_MAX_QUEUE', 32))
+client_ip_header = os.getenv('LOGIN_CLIENT_IP_HEADER') or None
+
+class BucketBackend:
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """Take one token; return 0 if allowed, else seconds until one is available."""
+        raise NotImplementedError
+
+class MemoryBucketBackend(BucketBackend):
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                retry_after = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) / rate
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+backend: BucketBackend = MemoryBucketBackend()
+_stats = {"allowed": 0, "limited_user": 0, "limited_ip": 0, "shed": 0}
+
+def set_backend(new_backend: BucketBackend):
+    global backend
+    backend = new_backend
+
+def client_ip(request):
+    if client_ip_header is not None:
+        forwarded = request.headers.get(client_ip_header)
+        if forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.client.host if request.client else None
+
+def check_login(username: str, client_ip: str | None):
+    # returns whole seconds for Retry-After, or None when the attempt may proceed
+    if client_ip is not None:
+        wait = backend.take(f"ip:{client_ip}", ip_rate, ip_burst)
+        if wait:
+            _stats["limited_ip"] += 1
+            return math.ceil(wait)
+    wait = backend.take(f"user:{username.lower()}", user_rate, user_burst)
+    if wait:
+        _stats["limited_user"] += 1
+        return math.ceil(wait)
+    _stats["allowed"] += 1
+    return None
+
+def record_shed():
+    _stats["shed"] += 1
+
+def get_stats():
+    return dict(_stats)
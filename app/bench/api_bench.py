@@ -0,0 +1,181 @@
+"""API load test and regression benchmark.
+
+Drives the real app in process through httpx's ASGI transport, or a running
+server with --url, against a seeded SQLite database. It covers login,
+product listing, cart add/update and purchase/checkout. It reports
+requests per second and p50/p95/p99 per endpoint and writes the results
+as JSON. With --baseline, the run fails if any endpoint's p95 or
+throughput regresses by more than --threshold, or if it has more errors
+than in the baseline (any error at all when the baseline had none).
+
+    python bench/api_bench.py --requests 2000 --concurrency 16 --out bench.json
+    python bench/api_bench.py --baseline bench.json --threshold 0.15
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+password = "bench-password"
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def seed(users: int, products: int, rng: random.Random):
+    import service.database as database
+    import Models.models as models
+    import Auth.hashing as hashing
+
+    hashed = hashing.get_password_hash(password)
+    db = database.sessionlocal()
+    try:
+        db.add_all(models.User(username=f"bench-{i}", hashed_password=hashed) for i in range(users))
+        db.add_all(
+            models.Product(name=f"product-{i}", description=f"seeded product {i} {rng.choice(['red', 'blue', 'green'])}",
+                           price=rng.randint(1, 500), stock=1_000_000)
+            for i in range(products)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+async def timed(client, results, name, method, url, **kwargs):
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    results.setdefault(name, []).append(time.perf_counter() - started)
+    if response.status_code >= 400:
+        results.setdefault(f"{name} errors", []).append(0.0)
+    return response
+
+async def session_flow(client, results, user_index: int, products: int, rng: random.Random):
+    response = await timed(client, results, "POST /token", "POST", "/token",
+                           data={"username": f"bench-{user_index}", "password": password})
+    token = response.json().get("access_token")
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = user_index + 1
+    await timed(client, results, "GET /products", "GET", "/products", headers=headers, params={"limit": 50})
+    cart = await timed(client, results, "POST /carts/{user_id}", "POST", f"/carts/{user_id}", headers=headers,
+                       json={"product_id": rng.randint(1, products), "quantity": 1})
+    cart_item_id = cart.json().get("id")
+    if cart_item_id is not None:
+        await timed(client, results, "PUT /carts/{cart_item_id}", "PUT", f"/carts/{cart_item_id}", headers=headers,
+                    json={"product_id": rng.randint(1, products), "quantity": 2})
+    await timed(client, results, "GET /carts/{user_id}", "GET", f"/carts/{user_id}", headers=headers)
+    await timed(client, results, "POST /checkout/{user_id}", "POST", f"/checkout/{user_id}", headers=headers)
+    await timed(client, results, "GET /purchases/{user_id}", "GET", f"/purchases/{user_id}", headers=headers)
+
+async def run(args):
+    import httpx
+
+    rng = random.Random(args.seed)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        return await drive(args, client)
+    path = os.path.join(tempfile.mkdtemp(), "api_bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    # every in-process request comes from one client address and the bench
+    # logs every user in, so the login limits are raised out of the way
+    for name, value in (("LOGIN_IP_RATE", 1_000_000), ("LOGIN_IP_BURST", 1_000_000),
+                        ("LOGIN_USER_RATE", 1_000), ("LOGIN_USER_BURST", 1_000)):
+        os.environ.setdefault(name, str(value))
+    from main import create_app
+    import service.database as database
+    import service.migrations as migrations
+
+    app = create_app()
+    # httpx's ASGI transport does not send lifespan events, so run it here
+    async with app.router.lifespan_context(app):
+        migrations.upgrade(database.engine)
+        seed(args.users, args.products, rng)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+        return await drive(args, client)
+
+async def drive(args, client):
+    results = {}
+    flows = max(1, args.requests // 7)
+    queue = asyncio.Queue()
+    for i in range(flows):
+        queue.put_nowait(i % args.users)
+
+    async def worker(worker_rng):
+        while not queue.empty():
+            await session_flow(client, results, queue.get_nowait(), args.products, worker_rng)
+
+    started = time.perf_counter()
+    async with client:
+        await asyncio.gather(*(worker(random.Random(args.seed + n)) for n in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    report = {"seconds": round(elapsed, 3), "concurrency": args.concurrency, "endpoints": {}}
+    for name, samples in sorted(results.items()):
+        if name.endswith(" errors"):
+            continue
+        report["endpoints"][name] = {
+            "requests": len(samples),
+            "errors": len(results.get(f"{name} errors", [])),
+            "rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        }
+    return report
+
+def compare(report, baseline, threshold: float):
+    failures = []
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        # errors are checked before timings: a failing request is usually fast
+        allowed_errors = previous.get("errors", 0) if previous is not None else 0
+        if current["errors"] > allowed_errors:
+            failures.append(f"{name}: {current['errors']} errors (baseline {allowed_errors})")
+        if previous is None:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            failures.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - threshold):
+            failures.append(f"{name}: rps {previous['rps']} -> {current['rps']}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"{'endpoint':32} {'reqs':>6} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, row in report["endpoints"].items():
+        print(f"{name:32} {row['requests']:6} {row['errors']:4} {row['rps']:8} "
+              f"{row['p50_ms']:8} {row['p95_ms']:8} {row['p99_ms']:8}")
+    with open(args.out, "w") as out:
+        json.dump(report, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            failures = compare(report, json.load(baseline_file), args.threshold)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
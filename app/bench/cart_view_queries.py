@@ -0,0 +1,64 @@
+"""Statements per cart view.
+
+Counts the statements service.crud.get_cart_view sends to a throwaway SQLite
+database for a 1-line and a 50-line cart, and exits non-zero if the counts
+differ, i.e. if the cart view has gone back to one query per line.
+
+    python bench/cart_view_queries.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "cart_view_queries.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["USE_ASYNC_DB"] = "false"
+
+    from sqlalchemy import event
+    import service.database as database
+    import service.crud as crud
+    import Models.models as models
+
+    database.init()
+    database.Base.metadata.create_all(bind=database.engine)
+
+    db = database.sessionlocal()
+    products = [models.Product(name=f"cart-view-{i}", description="", price=5, stock=10) for i in range(50)]
+    small = models.User(username="cart-view-1", hashed_password="x")
+    large = models.User(username="cart-view-50", hashed_password="x")
+    db.add_all([small, large, *products])
+    db.flush()
+    db.add(models.CartItem(user_id=small.id, product_id=products[0].id, quantity=1))
+    db.add_all(models.CartItem(user_id=large.id, product_id=product.id, quantity=1) for product in products)
+    db.commit()
+    carts = [(1, small.id), (50, large.id)]
+    db.close()
+
+    statements = []
+
+    @event.listens_for(database.engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    counts = []
+    for lines, user_id in carts:
+        db = database.sessionlocal()
+        statements.clear()
+        try:
+            view = crud.get_cart_view(db, user_id)
+        finally:
+            db.close()
+        if len(view["items"]) != lines:
+            print(f"FAIL: expected {lines} cart lines, got {len(view['items'])}")
+            sys.exit(1)
+        counts.append(len(statements))
+        print(f"{lines:2}-line cart {len(statements):3} statements")
+    if len(set(counts)) != 1:
+        print("FAIL: get_cart_view issues more statements for a larger cart")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Concurrent checkout check.
+
+Seeds one product with --stock units and --buyers users who each have
+--quantity of it in their cart, then runs every checkout at once. Exits
+non-zero if stock goes negative or more units are sold than were in stock.
+
+A second round checks one cart submitted --repeats times at once (a double
+click or a client retry): exactly one checkout may succeed and the cart may
+be sold only once.
+
+    python bench/checkout_concurrency.py --stock 10 --buyers 50 --repeats 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stock", type=int, default=10)
+    parser.add_argument("--buyers", type=int, default=50)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=8)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "checkout.db")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{path}")
+    os.environ["USE_ASYNC_DB"] = "false"
+
+    import service.database as database
+    import Models.models as models
+    import service.crud as crud
+    from service.exceptions import CheckoutError
+
+    database.init()
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.sessionlocal()
+    product = models.Product(name="contended", description="", price=5, stock=args.stock)
+    db.add(product)
+    db.flush()
+    user_ids = []
+    for i in range(args.buyers):
+        user = models.User(username=f"buyer-{i}", hashed_password="")
+        db.add(user)
+        db.flush()
+        db.add(models.CartItem(user_id=user.id, product_id=product.id, quantity=args.quantity))
+        user_ids.append(user.id)
+    db.commit()
+    product_id = product.id
+    db.close()
+
+    def buy(user_id):
+        session = database.sessionlocal()
+        try:
+            crud.checkout(session, user_id)
+            return "ok"
+        except CheckoutError:
+            return "rejected"
+        except Exception as exc:
+            return f"error: {exc.__class__.__name__}"
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=args.buyers) as pool:
+        outcomes = list(pool.map(buy, user_ids))
+
+    db = database.sessionlocal()
+    stock = db.get(models.Product, product_id).stock
+    sold = db.query(models.Purchase).filter(models.Purchase.product_id == product_id).count() * args.quantity
+    db.close()
+
+    print({outcome: outcomes.count(outcome) for outcome in set(outcomes)})
+    print(f"stock left: {stock}, units sold: {sold}")
+    if stock < 0 or sold > args.stock or stock + sold != args.stock:
+        print("FAIL: oversold")
+        sys.exit(1)
+
+    # same cart, checked out concurrently
+    db = database.sessionlocal()
+    product = models.Product(name="repeated", description="", price=5, stock=args.quantity * args.repeats)
+    user = models.User(username="repeat-buyer", hashed_password="")
+    db.add_all([product, user])
+    db.flush()
+    db.add(models.CartItem(user_id=user.id, product_id=product.id, quantity=args.quantity))
+    db.commit()
+    product_id, user_id, initial = product.id, user.id, product.stock
+    db.close()
+
+    with ThreadPoolExecutor(max_workers=args.repeats) as pool:
+        outcomes = list(pool.map(buy, [user_id] * args.repeats))
+
+    db = database.sessionlocal()
+    stock = db.get(models.Product, product_id).stock
+    purchases = db.query(models.Purchase).filter(models.Purchase.product_id == product_id).count()
+    db.close()
+
+    print({outcome: outcomes.count(outcome) for outcome in set(outcomes)})
+    print(f"same cart x{args.repeats}: purchases: {purchases}, units taken: {initial - stock}")
+    if outcomes.count("ok") != 1 or purchases != 1 or initial - stock != args.quantity:
+        print("FAIL: cart checked out more than once")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
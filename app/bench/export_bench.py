@@ -0,0 +1,56 @@
+"""Export throughput benchmark.
+
+Seeds a throwaway SQLite database with ROWS products and streams them
+through service.export, reporting rows per second and peak RSS.
+
+    python bench/export_bench.py --rows 1000000 --format csv
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "export_bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["USE_ASYNC_DB"] = "false"
+
+    import service.database as database
+    import Models.models as models
+    import service.export as export
+
+    database.init()
+    database.Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as conn:
+        batch = 10_000
+        for start in range(0, args.rows, batch):
+            conn.execute(models.Product.__table__.insert(), [
+                {"name": f"product-{i}", "description": f"description {i}", "price": i % 1000, "stock": i % 50}
+                for i in range(start, min(start + batch, args.rows))
+            ])
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    size = 0
+    for chunk in export.stream_sync(export.products_statement(), args.format):
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"rows: {args.rows}")
+    print(f"bytes: {size}")
+    print(f"seconds: {elapsed:.2f}")
+    print(f"rows/s: {args.rows / elapsed:,.0f}")
+    print(f"peak rss: {rss_after / 1024:.1f} MiB (before export {rss_before / 1024:.1f} MiB)")
+
+if __name__ == "__main__":
+    main()
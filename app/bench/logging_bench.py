@@ -0,0 +1,54 @@
+"""Logging overhead benchmark.
+
+Measures the time a request thread spends per log call with the old
+basicConfig FileHandler and with the queue pipeline from config.config.
+A request logs roughly five records, so per-request overhead is about
+five times the per-call figure.
+
+    python bench/logging_bench.py --records 100000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def measure(logger, records):
+    started = time.perf_counter()
+    for i in range(records):
+        logger.info("Fetching user with username %s from the database", f"user-{i}")
+    return (time.perf_counter() - started) / records * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100_000)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+
+    root = logging.getLogger()
+    file_handler = logging.FileHandler(os.path.join(directory, "sync.txt"))
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root.handlers[:] = [file_handler]
+    root.setLevel(logging.INFO)
+    sync_us = measure(logging.getLogger("service.crud"), args.records)
+
+    os.environ["LOG_FILE"] = os.path.join(directory, "queue.txt")
+    import config.config as config
+    config.setup_logging()
+    queue_us = measure(logging.getLogger("service.crud"), args.records)
+
+    while not config.listener.queue.empty():
+        time.sleep(0.01)
+    root.handlers[0].addFilter(config.SamplingFilter({"service.crud": 0.1}))
+    sampled_us = measure(logging.getLogger("service.crud"), args.records)
+
+    print(f"FileHandler: {sync_us:.2f} us per call")
+    print(f"queue pipeline: {queue_us:.2f} us per call")
+    print(f"queue pipeline, service.crud sampled at 0.1: {sampled_us:.2f} us per call")
+    print(f"per request (5 calls): {sync_us * 5:.1f} us -> {queue_us * 5:.1f} us")
+
+if __name__ == "__main__":
+    main()
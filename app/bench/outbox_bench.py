@@ -0,0 +1,103 @@
+"""Outbox drain benchmark.
+
+Creates --purchases purchases through service.crud while the outbox worker
+pool runs, with an extra purchase.created handler that sleeps
+--handler-ms to stand in for slow follow-up work. It reports
+create_purchase p50/p95, the wall time of the whole write loop, how late a
+probe task running alongside it wakes up, and how long the pool takes to
+drain the outbox. None of the first three should move with --handler-ms:
+handlers that block the event loop show up in the wall time and probe lag
+even when each create_purchase call is fast.
+
+    python bench/outbox_bench.py --purchases 500 --handler-ms 20 --workers 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+async def run(args):
+    import service.database as database
+    import service.crud as crud
+    import service.outbox as outbox
+    import Models.models as models
+    import Schemas.schemas as schemas
+
+    database.init()
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.sessionlocal()
+    user = models.User(username="outbox-bench", hashed_password="")
+    product = models.Product(name="outbox-bench", description="", price=5, stock=1_000_000)
+    db.add_all([user, product])
+    db.commit()
+    user_id, product_id = user.id, product.id
+    db.close()
+
+    @outbox.handler("purchase.created")
+    def slow_follow_up(db, payload):
+        time.sleep(args.handler_ms / 1000)
+
+    outbox.workers = args.workers
+    await outbox.start()
+    lags = []
+    writing = True
+
+    async def probe():
+        # stands in for a request served while the purchases are written
+        while writing:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - started - 0.005)
+
+    probe_task = asyncio.create_task(probe())
+    latencies = []
+    loop_started = time.perf_counter()
+    for _ in range(args.purchases):
+        db = database.sessionlocal()
+        started = time.perf_counter()
+        crud.create_purchase(db, schemas.PurchaseCreate(total_price=5, product_id=product_id), user_id)
+        latencies.append(time.perf_counter() - started)
+        db.close()
+        await asyncio.sleep(0)
+    written = time.perf_counter()
+    writing = False
+    await probe_task
+    while True:
+        stats = outbox.get_stats()
+        if stats["processed"] + stats["failed"] >= args.purchases:
+            break
+        await asyncio.sleep(0.05)
+    drained = time.perf_counter() - written
+    await outbox.stop()
+
+    print(f"create_purchase p50 {percentile(latencies, 0.50) * 1000:.2f}ms "
+          f"p95 {percentile(latencies, 0.95) * 1000:.2f}ms")
+    print(f"write loop {written - loop_started:.2f}s for {args.purchases} purchases "
+          f"({args.purchases / (written - loop_started):.0f}/s)")
+    print(f"probe wake-up lag p50 {percentile(lags, 0.50) * 1000:.2f}ms "
+          f"p95 {percentile(lags, 0.95) * 1000:.2f}ms max {max(lags) * 1000:.2f}ms")
+    print(f"outbox drained {stats['processed']} events ({stats['failed']} failed) "
+          f"{drained:.2f}s after the last write with {args.workers} workers")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--purchases", type=int, default=500)
+    parser.add_argument("--handler-ms", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "outbox_bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["USE_ASYNC_DB"] = "false"
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
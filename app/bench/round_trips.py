@@ -0,0 +1,101 @@
+"""Round trips per write.
+
+Counts the statements each service.crud write sends to a throwaway
+SQLite database (COMMIT included) and exits non-zero if any operation needs
+more than its budget. The budgets assume UPDATE/DELETE ... RETURNING;
+--no-returning forces the fallback path, which adds one SELECT.
+
+    python bench/round_trips.py
+    python bench/round_trips.py --no-returning
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-returning", action="store_true")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "round_trips.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["USE_ASYNC_DB"] = "false"
+
+    from sqlalchemy import event
+    import service.database as database
+    import service.crud as crud
+    import Models.models as models
+    import Schemas.schemas as schemas
+    import service.sales as sales
+
+    database.init()
+    database.Base.metadata.create_all(bind=database.engine)
+    if args.no_returning:
+        database.engine.dialect.update_returning = False
+        database.engine.dialect.delete_returning = False
+
+    statements = []
+
+    @event.listens_for(database.engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    @event.listens_for(database.engine, "commit")
+    def count_commit(conn):
+        statements.append("COMMIT")
+
+    db = database.sessionlocal()
+    user = models.User(username="round-trip", hashed_password="x")
+    product = models.Product(name="round-trip", description="", price=5, stock=10)
+    others = [models.Product(name=f"round-trip-{i}", description="", price=5, stock=10) for i in range(49)]
+    db.add_all([user, product, *others])
+    db.flush()
+    item = models.CartItem(user_id=user.id, product_id=product.id, quantity=1)
+    purchase = models.Purchase(user_id=user.id, product_id=product.id, quantity=1, total_price=5,
+                               created_at=sales.utcnow())
+    db.add_all([item, purchase])
+    db.commit()
+    ids = {"user": user.id, "product": product.id, "item": item.id, "purchase": purchase.id}
+    cart = [schemas.CartItemCreate(product_id=p.id, quantity=1) for p in [product, *others]]
+    db.close()
+
+    extra = 1 if args.no_returning else 0
+    operations = [
+        ("update_product", lambda db: crud.update_product(db, ids["product"], schemas.ProductUpdate(stock=9)), 3 + extra),
+        ("update_cart_item", lambda db: crud.update_cart_item(db, ids["item"], schemas.CartItemUpdate(quantity=2)), 2 + extra),
+        ("add_item_to_cart", lambda db: crud.add_item_to_cart(db, cart[0], ids["user"]), 2),
+        # a 50-line cart: check the products, read, batched update, batched
+        # insert, read back
+        ("replace_cart", lambda db: crud.replace_cart(db, ids["user"], cart), 6),
+        # purchase writes also upsert PRODUCT_SALES, USER_SALES and DAILY_SALES;
+        # an update first reads the old amounts under a row lock. Product,
+        # purchase and user writes also bump their RESOURCE_VERSIONS row.
+        ("update_purchase", lambda db: crud.update_purchase(db, ids["purchase"], schemas.PurchaseUpdate(total_price=6)), 7 + extra),
+        ("update_user", lambda db: crud.update_user(db, ids["user"], schemas.UserUpdate(username="renamed")), 2 + extra),
+        ("delete_cart_item", lambda db: crud.delete_cart_item(db, ids["item"]), 2 + extra),
+        ("delete_purchase", lambda db: crud.delete_purchase(db, ids["purchase"]), 6 + extra),
+        # two UPDATEs detach the user's cart items and purchases and a DELETE
+        # drops their USER_SALES row first
+        ("delete_user", lambda db: crud.delete_user(db, ids["user"]), 6 + extra),
+        ("delete_product", lambda db: crud.delete_product(db, ids["product"]), 3 + extra),
+    ]
+
+    failed = False
+    for name, operation, budget in operations:
+        db = database.sessionlocal()
+        statements.clear()
+        try:
+            row = operation(db)
+        finally:
+            db.close()
+        status = "ok" if row is not None and len(statements) <= budget else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"{name:18} {len(statements):3} round trips (budget {budget}) {status}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Product search latency.
+
+Seeds --products products (1M by default) into a throwaway SQLite database
+through the migrations, so the FTS5 index is kept by its triggers as in
+production, then runs a mix of broad and narrow queries through
+service.search, first pages and keyset pages. It reports p50/p99 per query
+and overall, and exits non-zero if the overall p99 is above --budget-ms.
+
+    python bench/search_bench.py
+    python bench/search_bench.py --products 300000 --rounds 50
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+queries = ["la", "lam", "lamp", "red lamp", "red la", "blue chair", "laptop stand", "nomatch"]
+words = ["lamp", "lamps", "laptop", "large", "red", "blue", "green", "chair", "table", "stand", "desk", "light"]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def vocabulary(rng: random.Random, size: int):
+    syllables = ["la", "mp", "re", "do", "ka", "ti", "ro", "be", "su", "ne", "mo", "pa", "li", "gu", "ve", "sa"]
+    made = {"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(size)}
+    return sorted(made) + words
+
+def seed(products: int, rng: random.Random):
+    from sqlalchemy import insert
+    import service.database as database
+    import Models.models as models
+
+    vocab = vocabulary(rng, 6000)
+    batch = []
+    with database.engine.begin() as conn:
+        for i in range(products):
+            name = " ".join(rng.choice(vocab) for _ in range(3))
+            batch.append({"name": f"{name} {i}", "description": " ".join(rng.choice(vocab) for _ in range(12)),
+                          "price": rng.randint(1, 500), "stock": rng.randint(0, 50)})
+            if len(batch) == 10000:
+                conn.execute(insert(models.Product), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.Product), batch)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "search_bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["USE_ASYNC_DB"] = "false"
+
+    import service.database as database
+    import service.migrations as migrations
+    import service.search as search
+
+    database.init()
+    migrations.upgrade(database.engine)
+    started = time.perf_counter()
+    seed(args.products, random.Random(args.seed))
+    print(f"seeded {args.products} products in {time.perf_counter() - started:.1f}s")
+
+    timings = {}
+    db = database.sessionlocal()
+    try:
+        for _ in range(args.rounds):
+            for q in queries:
+                started = time.perf_counter()
+                _, next_cursor = search.search_products(db, q, args.limit)
+                timings.setdefault(q, []).append(time.perf_counter() - started)
+                if next_cursor is not None:
+                    started = time.perf_counter()
+                    search.search_products(db, q, args.limit, next_cursor)
+                    timings.setdefault(f"{q} (page 2)", []).append(time.perf_counter() - started)
+    finally:
+        db.close()
+
+    print(f"{'query':24} {'p50':>8} {'p99':>8}")
+    for q, samples in timings.items():
+        print(f"{q:24} {percentile(samples, 0.50) * 1000:8.2f} {percentile(samples, 0.99) * 1000:8.2f}")
+    overall = percentile([sample for samples in timings.values() for sample in samples], 0.99) * 1000
+    status = "ok" if overall <= args.budget_ms else "FAIL"
+    print(f"overall p99 {overall:.2f}ms (budget {args.budget_ms}ms) {status}")
+    if status == "FAIL":
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
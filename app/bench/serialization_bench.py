@@ -0,0 +1,73 @@
+"""List serialization microbenchmark.
+
+For each list schema, compares the old response path (ORM-like objects
+validated through a precompiled TypeAdapter, jsonable_encoder, then
+json.dumps as JSONResponse renders it) with service.serializers (column
+tuples encoded with orjson). It checks that both produce identical bytes.
+
+    python bench/serialization_bench.py --rows 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def sample_rows(schema_name: str, count: int):
+    if schema_name == "User":
+        return [(f"user-{i}", i) for i in range(count)]
+    if schema_name == "Product":
+        return [(f"product-{i}", f"description of product {i} ünïcode", i % 1000, i % 50, i) for i in range(count)]
+    if schema_name == "CartItem":
+        return [(i % 5 + 1, i % 1000, i, i % 20) for i in range(count)]
+    return [(i * 1.25, i, i % 20, i % 1000, i % 3 + 1) for i in range(count)]
+
+def best_of(func, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import BaseModel, TypeAdapter
+    import Schemas.schemas as schemas
+    import service.serializers as serializers
+
+    for name in ("User", "Product", "CartItem", "Purchase"):
+        schema = getattr(schemas, name)
+        page = type(f"{name}Page", (BaseModel,), {"__annotations__": {"items": list[schema], "next_cursor": str | None},
+                                                  "next_cursor": None})
+        adapter = TypeAdapter(page)
+        serializer = serializers.for_schema(schema)
+        rows = sample_rows(name, args.rows)
+        objects = [SimpleNamespace(**dict(zip(serializer.fields, row))) for row in rows]
+
+        def old_path():
+            validated = adapter.validate_python({"items": objects, "next_cursor": "abc"}, from_attributes=True)
+            content = jsonable_encoder(validated)
+            return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+        def new_path():
+            return serializer.dump_page(rows, "abc")
+
+        if old_path() != new_path():
+            print(f"{name}: OUTPUT DIFFERS")
+            sys.exit(1)
+        old = best_of(old_path, args.repeat)
+        new = best_of(new_path, args.repeat)
+        print(f"{name:10} {args.rows} rows  response_model {old * 1000:7.2f} ms  fast path {new * 1000:7.2f} ms  "
+              f"x{old / new:.1f}")
+
+if __name__ == "__main__":
+    main()
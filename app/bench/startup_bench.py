@@ -0,0 +1,75 @@
+"""Cold-start benchmark.
+
+Each run is a fresh interpreter that imports main, builds the app, runs the
+lifespan startup and serves one request through httpx's ASGI transport.
+Reports the median of each phase over --runs, so a module that does work at
+import time, or a startup step that grows, shows up here.
+
+    python bench/startup_bench.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+child = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {app_dir!r})
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+
+async def first_request():
+    import httpx
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/metrics")
+        served = time.perf_counter()
+    return ready, served, response.status_code
+
+ready, served, status = asyncio.run(first_request())
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "lifespan_ms": (ready - created) * 1000,
+    "first_request_ms": (served - ready) * 1000,
+    "total_ms": (served - started) * 1000,
+    "status": status,
+}}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}")
+    env.setdefault("SECRET_KEY", "bench-secret")
+    env.setdefault("ALGORITHM", "HS256")
+    env.setdefault("LOG_FILE", os.devnull)
+    script = child.format(app_dir=app_dir)
+
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", script], env=env, cwd=app_dir,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    for phase in ("import_ms", "create_app_ms", "lifespan_ms", "first_request_ms", "total_ms"):
+        print(f"{phase:18} {statistics.median(s[phase] for s in samples):9.1f}")
+    if any(s["status"] != 200 for s in samples):
+        print("FAIL: first request did not return 200")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
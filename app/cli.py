@@ -0,0 +1,95 @@
+import argparse
+import csv
+import json
+import sys
+import config.config as config
+
+def init_database():
+    import service.database as database
+
+    config.setup_logging()
+    database.init()
+    return database
+
+def import_products(args):
+    import service.product_import as product_import
+
+    database = init_database()
+    db = database.sessionlocal()
+    try:
+        with open(args.path, newline="", encoding="utf-8-sig") as feed:
+            if args.path.endswith(".json"):
+                rows = json.load(feed)
+            else:
+                rows = csv.DictReader(feed)
+            report = product_import.import_rows(db, rows)
+    finally:
+        db.close()
+    for error in report["errors"]:
+        print(f"row {error['row']}: {error['error']}")
+    print(f"{report['upserted']} of {report['received']} rows upserted in {report['seconds']}s "
+          f"({report['rows_per_second']} rows/s)")
+
+def migrate(args):
+    import service.migrations as migrations
+
+    database = init_database()
+    version = migrations.upgrade(database.engine)
+    print(f"database at schema version {version}")
+
+def check_plans(args):
+    import service.migrations as migrations
+
+    database = init_database()
+    migrations.upgrade(database.engine)
+    failures = migrations.check_query_plans(database.engine)
+    for name, plan in failures.items():
+        print(f"{name}: {' / '.join(plan)}")
+    if failures:
+        sys.exit(1)
+    print("all hot queries use an index")
+
+def rebuild_sales(args):
+    import service.sales as sales
+
+    database = init_database()
+    db = database.sessionlocal()
+    try:
+        sales.rebuild(db)
+    finally:
+        db.close()
+    print("sales aggregates rebuilt from PURCHASE")
+
+def purge_idempotency_keys(args):
+    import service.idempotency as idempotency
+
+    database = init_database()
+    db = database.sessionlocal()
+    try:
+        purged = idempotency.purge(db)
+    finally:
+        db.close()
+    print(f"{purged} expired idempotency keys removed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ecommerce Application management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    products = commands.add_parser("import-products", help="upsert products from a CSV or JSON feed")
+    products.add_argument("path")
+    products.add_argument("--chunk-size", type=int)
+    products.set_defaults(func=import_products)
+
+    commands.add_parser("migrate", help="create the schema or apply pending migrations").set_defaults(func=migrate)
+    commands.add_parser("rebuild-sales", help="recompute the sales aggregates from PURCHASE").set_defaults(func=rebuild_sales)
+    commands.add_parser("purge-idempotency-keys", help="delete stored responses past their TTL").set_defaults(func=purge_idempotency_keys)
+    commands.add_parser("check-plans", help="fail if a hot query falls back to a table scan or a sorted page").set_defaults(func=check_plans)
+
+    args = parser.parse_args()
+    if getattr(args, "chunk_size", None):
+        import service.product_import as product_import
+        product_import.chunk_size = args.chunk_size
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,93 @@
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+import atexit
+import json
 import logging
+import os
+import queue
+import random
 
-logging.basicConfig(
-    filename="application.txt",
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# settings are read from the environment; .env fills in anything unset
+load_dotenv()
 
-logger = logging.getLogger(__name__)
\ No newline at end of file
+# Single logging setup for the whole application. Request code only puts the
+# unformatted record on an in-memory queue; a background listener thread does
+# the message formatting, JSON encoding and file write.
+#
+#   LOG_FILE      path of the log file (default application.txt)
+#   LOG_LEVEL     root level (default INFO)
+#   LOG_SAMPLING  per-logger sample rates for records below WARNING,
+#                 e.g. "service.crud=0.1,Auth.depends=0.25"
+
+log_file = os.getenv('LOG_FILE', 'application.txt')
+log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+def parse_sampling(value: str):
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+sampling = parse_sampling(os.getenv('LOG_SAMPLING', ''))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # QueueHandler formats in the caller's thread; leave that to the listener
+        return record
+
+listener = None
+
+def setup_logging():
+    # started from the app lifespan (or a command), never on import, so a
+    # preforked worker owns its listener thread
+    global listener
+    if listener is not None:
+        return listener
+    log_queue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+
+    handler = LazyQueueHandler(log_queue)
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(log_level)
+
+    listener.start()
+    atexit.register(stop_logging)
+    return listener
+
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+logger = logging.getLogger(__name__)
@@ -1,26 +1,57 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+import config.config as config
 import service.database as database
+import service.metrics as metrics
+import service.catalog_cache as catalog_cache
+import Auth.depends as depends
 from router.routers import router
 from config.config import logger
+import Auth.hashing as hashing
+import Auth.rate_limit as rate_limit
+import service.outbox as outbox
+import service.idempotency as idempotency
 
-database.Base.metadata.create_all(bind=database.engine)
+# Importing this module does no I/O and starts no threads. Engines, the log
+# listener and the hashing pool are created per worker in the lifespan, and
+# the schema is managed with `python cli.py migrate`.
 
-app = FastAPI(
-    title="Ecommerce Application", 
-    description="E-commerce API created with FastAPI and JWT Authentication"
-    )
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config.setup_logging()
+    database.init()
+    for engine in database.all_engines():
+        metrics.instrument_engine(engine)
+    await outbox.start()
+    logger.info("application startup")
+    yield
+    await outbox.stop()
+    hashing.shutdown_executor()
+    await database.dispose()
+    logger.info("application shutdown")
+    config.stop_logging()
 
-app.include_router(router)
+def create_app():
+    app = FastAPI(
+        title="Ecommerce Application",
+        description="E-commerce API created with FastAPI and JWT Authentication",
+        lifespan=lifespan
+        )
 
+    app.include_router(router)
+    app.add_middleware(metrics.MetricsMiddleware)
 
-@app.on_event("startup")
-async def startup():
-    logger.info("application startup")
+    metrics.register_gauges("user_cache", depends.get_user_cache_stats)
+    metrics.register_gauges("password_hashing", hashing.get_stats)
+    metrics.register_gauges("catalog_cache", catalog_cache.stats)
+    metrics.register_gauges("db_pool", database.get_pool_stats)
+    metrics.register_gauges("login_rate_limit", rate_limit.get_stats)
+    metrics.register_gauges("outbox", outbox.get_stats)
+    metrics.register_gauges("idempotency", idempotency.get_stats)
+    return app
 
-@app.on_event("shutdown")
-async def startup():
-    logger.info("application shutdown")
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, port=8000)
\ No newline at end of file
+    uvicorn.run(app, port=8000)
@@ -1,6 +1,6 @@
 from service.database import Base
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, Date, DateTime, LargeBinary, text
 
 class User(Base):
     __tablename__ = "USERTABLE"
@@ -15,20 +15,33 @@ class Product(Base):
     __tablename__ = "PRODUCTSTABLE"
     id = Column(Integer, primary_key= True, autoincrement= True)
     name = Column(String, unique= True, index= True)
-    description = Column(String, index= True)
+    description = Column(String)
     price = Column(Integer)
     stock = Column(Integer)
 
+    # price bands are paged on (price, id); the partial indexes keep stock
+    # filters in id order without walking the products they leave out
+    __table_args__ = (Index("ix_PRODUCTSTABLE_price_id", "price", "id"),
+                      Index("ix_PRODUCTSTABLE_in_stock", "id", sqlite_where=text("stock > 0"),
+                            postgresql_where=text("stock > 0")),
+                      Index("ix_PRODUCTSTABLE_out_of_stock", "id", sqlite_where=text("stock <= 0"),
+                            postgresql_where=text("stock <= 0")))
+
 class CartItem(Base):
     __tablename__ = "CART_ITEMS"
     id = Column(Integer, primary_key= True, autoincrement= True)
     quantity = Column(Integer)
     user_id = Column(Integer, ForeignKey('USERTABLE.id'))
-    product_id = Column(Integer, ForeignKey('PRODUCTSTABLE.id'))
+    product_id = Column(Integer, ForeignKey('PRODUCTSTABLE.id'), index= True)
 
 
     onwer = relationship("User", back_populates="CART_ITEMS")
     product = relationship("Product")
+
+    # (user_id, id) serves a user's cart in id order, for cart pages and the
+    # cart view; the unique pair is the upsert target for adds
+    __table_args__ = (Index("ix_CART_ITEMS_user_id_id", "user_id", "id"),
+                      Index("ix_CART_ITEMS_user_id_product_id", "user_id", "product_id", unique=True))
     
 class Purchase(Base):
     __tablename__ = "PURCHASE"
@@ -36,7 +49,64 @@ class Purchase(Base):
     total_price = Column(Float)
     user_id = Column(Integer, ForeignKey('USERTABLE.id'))
 
-    product_id = Column(Integer, ForeignKey("PRODUCTSTABLE.id"))
+    product_id = Column(Integer, ForeignKey("PRODUCTSTABLE.id"), index= True)
+    quantity = Column(Integer, default=1)
+    created_at = Column(DateTime)
 
     buyer = relationship("User", back_populates="PURCHASE")
-    product = relationship("Product")
\ No newline at end of file
+    product = relationship("Product")
+
+    __table_args__ = (Index("ix_PURCHASE_user_id_id", "user_id", "id"),)
+
+# Sales aggregates, maintained by service.sales
+class ProductSales(Base):
+    __tablename__ = "PRODUCT_SALES"
+    product_id = Column(Integer, primary_key= True)
+    units = Column(Integer, nullable=False, default=0, index= True)
+    revenue = Column(Float, nullable=False, default=0, index= True)
+    purchases = Column(Integer, nullable=False, default=0)
+
+class UserSales(Base):
+    __tablename__ = "USER_SALES"
+    user_id = Column(Integer, primary_key= True)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+    purchases = Column(Integer, nullable=False, default=0)
+
+class DailySales(Base):
+    __tablename__ = "DAILY_SALES"
+    day = Column(Date, primary_key= True)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+    purchases = Column(Integer, nullable=False, default=0)
+
+# Transactional outbox, drained by service.outbox
+class OutboxEvent(Base):
+    __tablename__ = "OUTBOX"
+    id = Column(Integer, primary_key= True, autoincrement= True)
+    topic = Column(String, nullable=False)
+    payload = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+    available_at = Column(DateTime, nullable=False)
+    failed_at = Column(DateTime)
+    last_error = Column(String)
+
+    __table_args__ = (Index("ix_OUTBOX_failed_at_available_at", "failed_at", "available_at"),)
+
+# Stored responses for Idempotency-Key replays, see service.idempotency
+class IdempotencyKey(Base):
+    __tablename__ = "IDEMPOTENCY_KEYS"
+    key = Column(String, primary_key= True)
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index= True)
+
+# Version counters behind conditional GETs, see service.versions
+class ResourceVersion(Base):
+    __tablename__ = "RESOURCE_VERSIONS"
+    key = Column(String, primary_key= True)
+    version = Column(Integer, nullable=False)
+    modified_at = Column(DateTime, nullable=False)
@@ -1,59 +1,128 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import date
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-import service.crud as crud
+from sqlalchemy.exc import IntegrityError
+import service.async_crud as crud
+import service.export as export
+import service.catalog_cache as catalog_cache
+import service.product_import as product_import
+import service.metrics as metrics
+import service.database as database
+import service.versions as versions
+import service.serializers as serializers
+import service.idempotency as idempotency
+from service.exceptions import CartError, CheckoutError, IdempotencyInProgress, IdempotencyKeyReused
 import Schemas.schemas as schemas
 import Auth.depends as depends
+import Auth.hashing as hashing
+import Auth.rate_limit as rate_limit
 import logging 
 
-logging.basicConfig(filename="app.txt", level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+async def check_not_modified(db, request: Request, key: str, *params):
+    # the version is read in the session that then reads the body, so a body
+    # is never older than the ETag sent with it, even from a lagging replica
+    version, headers, not_modified = await crud.run(
+        db, versions.conditional, key, params,
+        request.headers.get("if-none-match"), request.headers.get("if-modified-since")
+    )
+    if not_modified:
+        return version, headers, Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return version, headers, None
+
+async def idempotent(db, request: Request, current_user: schemas.User, key: str, payload, call):
+    # call() runs at most once per key for this user and route; replays get
+    # the stored response and never reach crud
+    scoped = f"{current_user.id}:{request.method}:{request.url.path}:{key}"
+    try:
+        stored, replayed = await idempotency.execute(
+            db, scoped, idempotency.fingerprint(payload.model_dump_json().encode()), call
+        )
+    except IdempotencyKeyReused as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(exc)
+        )
+    except IdempotencyInProgress as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(exc),
+            headers={"Retry-After": "1"}
+        )
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return Response(stored.body, status_code=stored.status_code, media_type="application/json", headers=headers)
+
+def invalid_cursor(exc: ValueError):
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=str(exc)
+    )
+
 @router.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(depends.get_db)):
-    logger.info(f"Login attempt for user:{form_data.username}")
-    user = depends.authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(depends.get_db)):
+    logger.info("Login attempt for user:%s", form_data.username)
+    retry_after = rate_limit.check_login(form_data.username, rate_limit.client_ip(request))
+    if retry_after is not None:
+        logger.warning("rate limited login for user:%s", form_data.username)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(retry_after)}
+        )
+    if hashing.queue_depth() >= rate_limit.max_queue:
+        rate_limit.record_shed()
+        logger.warning("shedding login for user:%s, hashing queue full", form_data.username)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Login service busy",
+            headers={"Retry-After": "1"}
+        )
+    user = await depends.authenticate_user(db, form_data.username, form_data.password)
     if not user:
-        logger.warning(f"failed login for user:{form_data.username}")
+        logger.warning("failed login for user:%s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
         )
-    access_token = depends.create_access_token(data={"sub": user.username})
-    logger.info(f"user {form_data.username} logged in successfully")
+    access_token = depends.create_access_token(data={"sub": user.username, "uid": user.id})
+    logger.info("user %s logged in successfully", form_data.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
 # User Endpoints
-@router.get("/users", response_model=list[schemas.User], tags=["USER"])
-def read_users(db: Session = Depends(depends.get_db)):
-    users = crud.get_users(db)
-    logger.info("Retrieved all users")
-    return users
+@router.get("/users", response_model=schemas.UserPage, tags=["USER"])
+async def read_users(limit: int = Query(50, ge=1, le=500), cursor: str | None = None, db: Session = Depends(depends.get_read_db)):
+    try:
+        users, next_cursor = await crud.get_users(db, limit=limit, cursor=cursor)
+    except ValueError as exc:
+        raise invalid_cursor(exc)
+    logger.info("Retrieved users")
+    return Response(serializers.for_schema(schemas.User).dump_page(users, next_cursor), media_type="application/json")
 
 @router.post("/users", response_model=schemas.UserWithToken, tags=["USER"])
 async def create_user(user: schemas.UserCreate, db: Session = Depends(depends.get_db)):
-    logger.info(f"Creating new user: {user.username}")
-    db_user = crud.get_user_by_username(db, user.username)
+    logger.info("Creating new user: %s", user.username)
+    db_user = await crud.get_user_by_username(db, user.username)
     if db_user:
-        logger.warning(f"User {user.username} already exists")
+        logger.warning("User %s already exists", user.username)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
-    created_user = crud.create_user(db=db, user=user)
-    access_token = depends.create_access_token(data={"sub": created_user.username})
-    logger.info(f"User {user.username} created successfully")
+    created_user = await crud.create_user(db=db, user=user)
+    access_token = depends.create_access_token(data={"sub": created_user.username, "uid": created_user.id})
+    logger.info("User %s created successfully", user.username)
     return {"user": created_user, "access_token": access_token, "token_type": "bearer"}
 
 @router.put("/users/{user_id}", response_model=schemas.User, tags=["USER"])
 async def update_user(user_id: int, user: schemas.UserCreate, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    logger.info(f"Updating user: {user_id}")
-    db_user = crud.update_user(db, user_id, user)
+    logger.info("Updating user: %s", user_id)
+    db_user = await crud.update_user(db, user_id, user)
     if db_user is None:
-        logger.warning(f"User {user_id} not found")
+        logger.warning("User %s not found", user_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
@@ -61,12 +130,24 @@ async def update_user(user_id: int, user: schemas.UserCreate, db: Session = Depe
     logger.info("user updated successfully")
     return db_user
 
+@router.patch("/users/{user_id}", response_model=schemas.User, tags=["USER"])
+async def patch_user(user_id: int, user: schemas.UserUpdate, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    logger.info("Patching user: %s", user_id)
+    db_user = await crud.update_user(db, user_id, user)
+    if db_user is None:
+        logger.warning("User %s not found", user_id)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    return db_user
+
 @router.delete("/users/{user_id}", response_model=schemas.User, tags=["USER"])
 async def delete_user(user_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    logger.info(f"Deleting user: {user_id}")
-    db_user = crud.delete_user(db, user_id)
+    logger.info("Deleting user: %s", user_id)
+    db_user = await crud.delete_user(db, user_id)
     if db_user is None:
-        logger.warning(f"User {user_id} not found")
+        logger.warning("User %s not found", user_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
@@ -75,17 +156,88 @@ async def delete_user(user_id: int, db: Session = Depends(depends.get_db), curre
     return db_user
 
 # Product Endpoints
-@router.get("/products", response_model=list[schemas.Product], tags=["PRODUCT"])
-async def read_products(db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    return crud.get_products(db)
+@router.get("/products", response_model=schemas.ProductPage, tags=["PRODUCT"])
+async def read_products(request: Request, limit: int = Query(50, ge=1, le=500), cursor: str | None = None,
+                        min_price: float | None = None, max_price: float | None = None, in_stock: bool | None = None,
+                        db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    # the primary is read: a page from a lagging replica would be cached and
+    # served under the new catalog version. A hit costs only the version
+    # lookup, which also keys the cache, so another worker's write is seen.
+    version, headers, not_modified = await check_not_modified(db, request, "catalog", limit, cursor,
+                                                              min_price, max_price, in_stock)
+    if not_modified is not None:
+        return not_modified
+    key = catalog_cache.make_key("products", version, limit, cursor, min_price, max_price, in_stock)
+    body = catalog_cache.lookup(key)
+    if body is None:
+        try:
+            products, next_cursor = await crud.get_products(db, limit=limit, cursor=cursor, min_price=min_price,
+                                                            max_price=max_price, in_stock=in_stock)
+        except ValueError as exc:
+            raise invalid_cursor(exc)
+        body = serializers.for_schema(schemas.Product).dump_page(products, next_cursor)
+        catalog_cache.store(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/products/search", response_model=schemas.ProductPage, tags=["PRODUCT"])
+async def search_products(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100),
+                          cursor: str | None = None, db: Session = Depends(depends.get_read_db),
+                          current_user: schemas.User =Depends(depends.get_current_user)):
+    try:
+        products, next_cursor = await crud.search_products(db, q, limit=limit, cursor=cursor)
+    except ValueError as exc:
+        raise invalid_cursor(exc)
+    return {"items": products, "next_cursor": next_cursor}
+
+@router.get("/products/{product_id}", response_model=schemas.Product, tags=["PRODUCT"])
+async def read_product(product_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    # cache misses read the primary, as in read_products
+    key = catalog_cache.make_key("product", product_id)
+    body = catalog_cache.lookup(key)
+    if body is None:
+        db_product = await crud.get_product(db, product_id)
+        if db_product is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Product not found"
+            )
+        body = schemas.Product.model_validate(db_product).model_dump_json().encode()
+        catalog_cache.store(key, body)
+    return Response(content=body, media_type="application/json")
 
 @router.post("/products", response_model=schemas.Product, tags=["PRODUCT"])
 async def create_product(product: schemas.ProductCreate, db: Session = Depends(depends.get_db),current_user: schemas.User =Depends(depends.get_current_user)):
-    return crud.create_product(db=db, product=product)
+    return await crud.create_product(db=db, product=product)
+
+@router.post("/products/bulk", response_model=schemas.ProductImportResult, tags=["PRODUCT"])
+async def bulk_upsert_products(request: Request, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("text/csv"):
+        rows = product_import.iter_csv_stream(request.stream())
+    else:
+        payload = await request.json()
+        if not isinstance(payload, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected a JSON array of products"
+            )
+        rows = product_import.iter_list(payload)
+    logger.info("Bulk product import by %s", current_user.username)
+    return await product_import.import_rows_async(db, rows)
 
 @router.put("/products/{product_id}", response_model=schemas.Product, tags=["PRODUCT"])
 async def update_product(product_id: int, product: schemas.ProductCreate, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    db_product = crud.update_product(db, product_id, product)
+    db_product = await crud.update_product(db, product_id, product)
+    if db_product is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    return db_product
+
+@router.patch("/products/{product_id}", response_model=schemas.Product, tags=["PRODUCT"])
+async def patch_product(product_id: int, product: schemas.ProductUpdate, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    db_product = await crud.update_product(db, product_id, product)
     if db_product is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -95,7 +247,7 @@ async def update_product(product_id: int, product: schemas.ProductCreate, db: Se
 
 @router.delete("/products/{product_id}", response_model=schemas.Product, tags=["PRODUCT"])
 async def delete_product(product_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    db_product = crud.delete_product(db, product_id)
+    db_product = await crud.delete_product(db, product_id)
     if db_product is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -104,17 +256,83 @@ async def delete_product(product_id: int, db: Session = Depends(depends.get_db),
     return db_product
 
 # CartItem Endpoints
-@router.get("/carts/{user_id}", response_model=list[schemas.CartItem], tags=["CART"])
-async def read_cart(user_id: int, db: Session = Depends(depends.get_db),current_user: schemas.User =Depends(depends.get_current_user)):
-    return crud.get_cart_items(db, user_id=user_id)
+@router.get("/carts/{user_id}", response_model=schemas.CartItemPage, tags=["CART"])
+async def read_cart(user_id: int, limit: int = Query(50, ge=1, le=500), cursor: str | None = None,
+                    db: Session = Depends(depends.get_read_db),current_user: schemas.User =Depends(depends.get_current_user)):
+    try:
+        items, next_cursor = await crud.get_cart_items(db, user_id=user_id, limit=limit, cursor=cursor)
+    except ValueError as exc:
+        raise invalid_cursor(exc)
+    return Response(serializers.for_schema(schemas.CartItem).dump_page(items, next_cursor), media_type="application/json")
+
+@router.get("/carts/{user_id}/expanded", response_model=schemas.CartView, tags=["CART"])
+async def read_cart_expanded(user_id: int, db: Session = Depends(depends.get_read_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    return await crud.get_cart_view(db, user_id)
 
 @router.post("/carts/{user_id}", response_model=schemas.CartItem, tags=["CART"])
-async def add_item_to_cart(cart_item: schemas.CartItemCreate, user_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    return crud.add_item_to_cart(db=db, cart_item=cart_item, user_id=user_id)
+async def add_item_to_cart(request: Request, cart_item: schemas.CartItemCreate, user_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user),
+                           idempotency_key: str | None = Header(None, max_length=255)):
+    try:
+        if idempotency_key is None:
+            return await crud.add_item_to_cart(db=db, cart_item=cart_item, user_id=user_id)
+
+        async def call():
+            db_cart_item = await crud.add_item_to_cart(db=db, cart_item=cart_item, user_id=user_id)
+            return status.HTTP_200_OK, schemas.CartItem.model_validate(db_cart_item).model_dump_json().encode()
+        return await idempotent(db, request, current_user, idempotency_key, cart_item, call)
+    except CartError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(exc)
+        )
+
+# PUT /carts/{cart_item_id} already updates a single line, so the whole cart
+# is replaced under /items
+@router.put("/carts/{user_id}/items", response_model=list[schemas.CartItem], tags=["CART"])
+async def replace_cart(user_id: int, items: list[schemas.CartItemCreate], db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    if len(items) > 500:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A cart can hold at most 500 lines"
+        )
+    try:
+        return await crud.replace_cart(db, user_id, items)
+    except CartError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(exc)
+        )
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Cart changed concurrently"
+        )
 
 @router.put("/carts/{cart_item_id}", response_model=schemas.CartItem, tags=["CART"])
 async def update_cart_item(cart_item_id: int, cart_item: schemas.CartItemCreate, db: Session = Depends(depends.get_db),current_user: schemas.User =Depends(depends.get_current_user)):
-    db_cart_item = crud.update_cart_item(db, cart_item_id, cart_item)
+    try:
+        db_cart_item = await crud.update_cart_item(db, cart_item_id, cart_item)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="That product is already in the cart"
+        )
+    if db_cart_item is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cart item not found"
+        )
+    return db_cart_item
+
+@router.patch("/carts/{cart_item_id}", response_model=schemas.CartItem, tags=["CART"])
+async def patch_cart_item(cart_item_id: int, cart_item: schemas.CartItemUpdate, db: Session = Depends(depends.get_db),current_user: schemas.User =Depends(depends.get_current_user)):
+    try:
+        db_cart_item = await crud.update_cart_item(db, cart_item_id, cart_item)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="That product is already in the cart"
+        )
     if db_cart_item is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -124,7 +342,7 @@ async def update_cart_item(cart_item_id: int, cart_item: schemas.CartItemCreate,
 
 @router.delete("/carts/{cart_item_id}", response_model=schemas.CartItem, tags=["CART"])
 async def delete_cart_item(cart_item_id: int, db: Session = Depends(depends.get_db),current_user: schemas.User =Depends(depends.get_current_user)):
-    db_cart_item = crud.delete_cart_item(db, cart_item_id)
+    db_cart_item = await crud.delete_cart_item(db, cart_item_id)
     if db_cart_item is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -133,17 +351,43 @@ async def delete_cart_item(cart_item_id: int, db: Session = Depends(depends.get_
     return db_cart_item
 
 # Purchase Endpoints
-@router.get("/purchases/{user_id}", response_model=list[schemas.Purchase], tags=["PURCHASE"])
-async def read_purchases(user_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    return crud.get_purchases(db, user_id=user_id)
+@router.get("/purchases/{user_id}", response_model=schemas.PurchasePage, tags=["PURCHASE"])
+async def read_purchases(user_id: int, request: Request, limit: int = Query(50, ge=1, le=500), cursor: str | None = None,
+                         db: Session = Depends(depends.get_read_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    _, headers, not_modified = await check_not_modified(db, request, f"purchases:{user_id}", limit, cursor)
+    if not_modified is not None:
+        return not_modified
+    try:
+        purchases, next_cursor = await crud.get_purchases(db, user_id=user_id, limit=limit, cursor=cursor)
+    except ValueError as exc:
+        raise invalid_cursor(exc)
+    body = serializers.for_schema(schemas.Purchase).dump_page(purchases, next_cursor)
+    return Response(body, media_type="application/json", headers=headers)
 
 @router.post("/purchases/{user_id}", response_model=schemas.Purchase, tags=["PURCHASE"])
-async def create_purchase(purchase: schemas.PurchaseCreate, user_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    return crud.create_purchase(db=db, purchase=purchase, user_id=user_id)
+async def create_purchase(request: Request, purchase: schemas.PurchaseCreate, user_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user),
+                          idempotency_key: str | None = Header(None, max_length=255)):
+    if idempotency_key is None:
+        return await crud.create_purchase(db=db, purchase=purchase, user_id=user_id)
+
+    async def call():
+        db_purchase = await crud.create_purchase(db=db, purchase=purchase, user_id=user_id)
+        return status.HTTP_200_OK, schemas.Purchase.model_validate(db_purchase).model_dump_json().encode()
+    return await idempotent(db, request, current_user, idempotency_key, purchase, call)
 
 @router.put("/purchases/{purchase_id}", response_model=schemas.Purchase, tags=["PURCHASE"])
 async def update_purchase(purchase_id: int, purchase: schemas.PurchaseCreate, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
-    db_purchase = crud.update_purchase(db, purchase_id, purchase)
+    db_purchase = await crud.update_purchase(db, purchase_id, purchase)
+    if db_purchase is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Purchase not found"
+        )
+    return db_purchase
+
+@router.patch("/purchases/{purchase_id}", response_model=schemas.Purchase, tags=["PURCHASE"])
+async def patch_purchase(purchase_id: int, purchase: schemas.PurchaseUpdate, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    db_purchase = await crud.update_purchase(db, purchase_id, purchase)
     if db_purchase is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -153,10 +397,67 @@ async def update_purchase(purchase_id: int, purchase: schemas.PurchaseCreate, db
 
 @router.delete("/purchases/{purchase_id}", response_model=schemas.Purchase, tags=["PURCHASE"])
 async def delete_purchase(purchase_id: int, db: Session = Depends(depends.get_db),current_user: schemas.User =Depends(depends.get_current_user)):
-    db_purchase = crud.delete_purchase(db, purchase_id)
+    db_purchase = await crud.delete_purchase(db, purchase_id)
     if db_purchase is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Purchase not found"
         )
     return db_purchase
+
+# Checkout Endpoints
+@router.post("/checkout/{user_id}", response_model=schemas.CheckoutResult, tags=["PURCHASE"])
+async def checkout(user_id: int, db: Session = Depends(depends.get_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    logger.info("Checkout for user: %s", user_id)
+    try:
+        purchases = await crud.checkout(db, user_id)
+    except CheckoutError as exc:
+        logger.warning("Checkout failed for user %s: %s", user_id, exc)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(exc)
+        )
+    return {"purchases": purchases, "total_price": sum(p.total_price for p in purchases)}
+
+# Report Endpoints
+# These read only the sales aggregate tables, never PURCHASE
+@router.get("/reports/top-sellers", response_model=list[schemas.ProductSales], tags=["REPORT"])
+async def top_sellers(limit: int = Query(10, ge=1, le=100), by: str = Query("revenue", pattern="^(revenue|units)$"),
+                      db: Session = Depends(depends.get_read_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    return await crud.top_sellers(db, limit=limit, by=by)
+
+@router.get("/reports/daily-sales", response_model=list[schemas.DailySales], tags=["REPORT"])
+async def daily_sales(start: date | None = None, end: date | None = None, limit: int = Query(31, ge=1, le=366),
+                      db: Session = Depends(depends.get_read_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    return await crud.daily_sales(db, start=start, end=end, limit=limit)
+
+@router.get("/users/{user_id}/spend", response_model=schemas.UserSpend, tags=["REPORT"])
+async def lifetime_spend(user_id: int, db: Session = Depends(depends.get_read_db), current_user: schemas.User =Depends(depends.get_current_user)):
+    return await crud.lifetime_spend(db, user_id)
+
+# Export Endpoints
+@router.get("/export/products", tags=["EXPORT"])
+async def export_products(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), current_user: schemas.User =Depends(depends.get_current_user)):
+    logger.info("Exporting products as %s", format)
+    return StreamingResponse(export.stream(export.products_statement(), format), media_type=export.media_types[format])
+
+@router.get("/export/purchases", tags=["EXPORT"])
+async def export_purchases(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), user_id: int | None = None,
+                           current_user: schemas.User =Depends(depends.get_current_user)):
+    logger.info("Exporting purchases as %s", format)
+    return StreamingResponse(export.stream(export.purchases_statement(user_id), format), media_type=export.media_types[format])
+
+# Stats Endpoints
+@router.get("/stats", tags=["STATS"])
+async def read_stats():
+    return {
+        "user_cache": depends.get_user_cache_stats(),
+        "hashing": hashing.get_stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "db_pool": database.get_pool_stats(),
+        "login_rate_limit": rate_limit.get_stats(),
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=["STATS"])
+async def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
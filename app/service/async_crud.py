@@ -0,0 +1,109 @@
+from datetime import date
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import service.crud as crud
+import service.search as search
+import service.sales as sales
+import Schemas.schemas as schemas
+import Auth.hashing as hashing
+
+# Async versions of the service.crud functions. With an AsyncSession the sync
+# function is run through run_sync, so the query goes over the async driver and
+# never blocks the event loop. With a plain Session (USE_ASYNC_DB=false) the
+# function runs inline, which keeps the old behaviour available for benchmarks.
+
+async def run(db: AsyncSession | Session, func, *args, **kwargs):
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(func, *args, **kwargs)
+    return func(db, *args, **kwargs)
+
+async def get_users(db: AsyncSession, limit: int = 50, cursor: str | None = None):
+    return await run(db, crud.get_users, limit, cursor)
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await run(db, crud.get_user_by_username, username)
+
+# bcrypt runs in the hashing pool before the session is touched
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await hashing.get_password_hash_async(user.password)
+    return await run(db, crud.create_user, user, hashed_password)
+
+async def update_user(db: AsyncSession, user_id: int, user_update: schemas.UserCreate | schemas.UserUpdate):
+    hashed_password = None
+    if user_update.password is not None:
+        hashed_password = await hashing.get_password_hash_async(user_update.password)
+    return await run(db, crud.update_user, user_id, user_update, hashed_password)
+
+async def delete_user(db: AsyncSession, user_id: int):
+    return await run(db, crud.delete_user, user_id)
+
+# Product CRUD operations
+async def get_product(db: AsyncSession, product_id: int):
+    return await run(db, crud.get_product, product_id)
+
+async def get_products(db: AsyncSession, limit: int = 50, cursor: str | None = None,
+                       min_price: float | None = None, max_price: float | None = None, in_stock: bool | None = None):
+    return await run(db, crud.get_products, limit, cursor, min_price, max_price, in_stock)
+
+async def create_product(db: AsyncSession, product: schemas.ProductCreate):
+    return await run(db, crud.create_product, product)
+
+async def update_product(db: AsyncSession, product_id: int, product_update: schemas.ProductCreate | schemas.ProductUpdate):
+    return await run(db, crud.update_product, product_id, product_update)
+
+async def delete_product(db: AsyncSession, product_id: int):
+    return await run(db, crud.delete_product, product_id)
+
+async def upsert_products(db: AsyncSession, rows: list[tuple[int, dict]]):
+    return await run(db, crud.upsert_products, rows)
+
+async def search_products(db: AsyncSession, q: str, limit: int = 20, cursor: str | None = None):
+    return await run(db, search.search_products, q, limit, cursor)
+
+# CartItem CRUD operations
+async def get_cart_items(db: AsyncSession, user_id: int, limit: int = 50, cursor: str | None = None):
+    return await run(db, crud.get_cart_items, user_id, limit, cursor)
+
+async def get_cart_view(db: AsyncSession, user_id: int):
+    return await run(db, crud.get_cart_view, user_id)
+
+async def add_item_to_cart(db: AsyncSession, cart_item: schemas.CartItemCreate, user_id: int):
+    return await run(db, crud.add_item_to_cart, cart_item, user_id)
+
+async def replace_cart(db: AsyncSession, user_id: int, items: list[schemas.CartItemCreate]):
+    return await run(db, crud.replace_cart, user_id, items)
+
+async def update_cart_item(db: AsyncSession, cart_item_id: int, cart_item_update: schemas.CartItemCreate | schemas.CartItemUpdate):
+    return await run(db, crud.update_cart_item, cart_item_id, cart_item_update)
+
+async def delete_cart_item(db: AsyncSession, cart_item_id: int):
+    return await run(db, crud.delete_cart_item, cart_item_id)
+
+# Purchase CRUD operations
+async def get_purchase(db: AsyncSession, purchase_id: int):
+    return await run(db, crud.get_purchase, purchase_id)
+
+async def get_purchases(db: AsyncSession, user_id: int, limit: int = 50, cursor: str | None = None):
+    return await run(db, crud.get_purchases, user_id, limit, cursor)
+
+async def create_purchase(db: AsyncSession, purchase: schemas.PurchaseCreate, user_id: int):
+    return await run(db, crud.create_purchase, purchase, user_id)
+
+async def update_purchase(db: AsyncSession, purchase_id: int, purchase_update: schemas.PurchaseCreate | schemas.PurchaseUpdate):
+    return await run(db, crud.update_purchase, purchase_id, purchase_update)
+
+async def delete_purchase(db: AsyncSession, purchase_id: int):
+    return await run(db, crud.delete_purchase, purchase_id)
+
+async def checkout(db: AsyncSession, user_id: int):
+    return await run(db, crud.checkout, user_id)
+
+# Sales reports, answered from the aggregate tables
+async def top_sellers(db: AsyncSession, limit: int = 10, by: str = "revenue"):
+    return await run(db, sales.top_sellers, limit, by)
+
+async def lifetime_spend(db: AsyncSession, user_id: int):
+    return await run(db, sales.lifetime_spend, user_id)
+
+async def daily_sales(db: AsyncSession, start: date | None = None, end: date | None = None, limit: int = 31):
+    return await run(db, sales.daily, start, end, limit)
@@ -0,0 +1,83 @@
+from service.cache import TTLCache
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Read-through cache of serialized catalog responses. Keys embed the catalog
+# version, so a product write only has to bump the version: stale entries are
+# never read again and age out of the LRU. The backend is pluggable so a
+# shared store can replace the in-process one when running several workers.
+# Callers that know the catalog's RESOURCE_VERSIONS counter (service.versions)
+# put it in the key too, so a write made through another worker is not
+# served from this one's cache.
+
+class CacheBackend:
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes):
+        raise NotImplementedError
+
+    def get_version(self) -> int:
+        raise NotImplementedError
+
+    def incr_version(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def set(self, key: str, value: bytes):
+        self.cache.set(key, value)
+
+    def get_version(self):
+        return self.version
+
+    def incr_version(self):
+        with self._lock:
+            self.version += 1
+            self.cache.clear()
+            return self.version
+
+    def stats(self):
+        return dict(self.cache.stats(), version=self.version)
+
+backend: CacheBackend = MemoryBackend(
+    maxsize=int(os.getenv('CATALOG_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('CATALOG_CACHE_TTL', 300))
+)
+
+def set_backend(new_backend: CacheBackend):
+    global backend
+    backend = new_backend
+
+def make_key(name: str, *params):
+    return f"catalog:v{backend.get_version()}:{name}:" + ":".join(str(p) for p in params)
+
+def lookup(key: str):
+    return backend.get(key)
+
+def store(key: str, value: bytes):
+    backend.set(key, value)
+
+def invalidate():
+    version = backend.incr_version()
+    logger.info("Catalog cache invalidated, version %s", version)
+    return version
+
+def get_version():
+    return backend.get_version()
+
+def stats():
+    return backend.stats()
@@ -1,130 +1,454 @@
+from sqlalchemy import bindparam, exists, insert, literal, literal_column, select, update, delete
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import postgresql, sqlite
 import Models.models as models
 import Schemas.schemas as schemas
 import Auth.depends as depends
+from service.pagination import paginate, paginate_by_value
+import service.serializers as serializers
+import service.catalog_cache as catalog_cache
+import service.versions as versions
+import service.sales as sales
+import service.outbox as outbox
+from service.exceptions import CartError, CheckoutError
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_users(db: Session):
-    logger.info("Fetching all users from the database")
-    return db.query(models.User).all()
+# Single-statement writes. Updates and deletes by id are one
+# UPDATE/DELETE ... RETURNING of the response schema's columns where the
+# dialect has it (PostgreSQL, SQLite >= 3.35), instead of SELECT, write and
+# refresh. Elsewhere they fall back to two statements. Rows are returned as
+# column tuples, so nothing is reloaded after the commit.
+
+def returning(db: Session, kind: str):
+    return getattr(db.get_bind().dialect, f"{kind}_returning", False)
+
+def update_row(db: Session, model, schema, row_id: int, values: dict, extra=(), commit: bool = True):
+    # extra columns are returned after the schema's; commit=False leaves the
+    # transaction open for the caller
+    columns = serializers.for_schema(schema).columns(model) + list(extra)
+    if not values:
+        return db.query(*columns).filter(model.id == row_id).first()
+    stmt = update(model).where(model.id == row_id).values(**values).execution_options(synchronize_session=False)
+    if returning(db, "update"):
+        row = db.execute(stmt.returning(*columns)).first()
+    elif db.execute(stmt).rowcount:
+        row = db.query(*columns).filter(model.id == row_id).first()
+    else:
+        row = None
+    if commit:
+        db.commit()
+    return row
+
+def delete_row(db: Session, model, schema, row_id: int, extra=(), commit: bool = True):
+    columns = serializers.for_schema(schema).columns(model) + list(extra)
+    stmt = delete(model).where(model.id == row_id).execution_options(synchronize_session=False)
+    if returning(db, "delete"):
+        row = db.execute(stmt.returning(*columns)).first()
+    else:
+        row = db.query(*columns).filter(model.id == row_id).first()
+        if row is not None:
+            db.execute(stmt)
+    if commit:
+        db.commit()
+    return row
+
+def get_users(db: Session, limit: int = 50, cursor: str | None = None):
+    # list queries select only the schema's columns and return plain rows
+    logger.info("Fetching users from the database")
+    columns = serializers.for_schema(schemas.User).columns(models.User)
+    return paginate(db.query(*columns), models.User.id, limit, cursor)
 
 def get_user_by_username(db: Session, username: str):
-    logger.info(f"Fetching user with username {username} from the database")
+    logger.info("Fetching user with username %s from the database", username)
     return db.query(models.User).filter(models.User.username == username).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = depends.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str | None = None):
+    if hashed_password is None:
+        hashed_password = depends.get_password_hash(user.password)
     db_user = models.User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    logger.info(f"User with username {user.username} created successfully")
+    logger.info("User with username %s created successfully", user.username)
     return db_user
 
-def update_user(db: Session, user_id: int, user_update: schemas.UserCreate):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+def update_user(db: Session, user_id: int, user_update: schemas.UserCreate | schemas.UserUpdate,
+                hashed_password: str | None = None):
+    # only the fields that were sent are written, so this serves PUT and PATCH
+    values = user_update.model_dump(exclude_unset=True, exclude_none=True)
+    password = values.pop("password", None)
+    if password is not None:
+        values["hashed_password"] = hashed_password or depends.get_password_hash(password)
+    db_user = update_row(db, models.User, schemas.User, user_id, values)
     if db_user:
-        db_user.username = user_update.username
-        db_user.hashed_password = depends.get_password_hash(user_update.password)
-        db.commit()
-        db.refresh(db_user)
-        logger.info(f"User with id {user_id} updated successfully")
+        depends.invalidate_user(user_id)
+        logger.info("User with id %s updated successfully", user_id)
     return db_user
 
 def delete_user(db: Session, user_id: int):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    # the ORM used to null these references when it deleted a loaded user
+    for model in (models.CartItem, models.Purchase):
+        db.execute(
+            update(model).where(model.user_id == user_id).values(user_id=None)
+            .execution_options(synchronize_session=False)
+        )
+    db.execute(delete(models.UserSales).where(models.UserSales.user_id == user_id))
+    db_user = delete_row(db, models.User, schemas.User, user_id, commit=False)
     if db_user:
-        db.delete(db_user)
-        db.commit()
-        logger.info(f"User with id {user_id} deleted successfully")
+        # the user's purchases no longer list under them
+        versions.bump(db, f"purchases:{user_id}")
+    db.commit()
+    if db_user:
+        depends.invalidate_user(user_id)
+        logger.info("User with id %s deleted successfully", user_id)
     return db_user
 
 # Product CRUD operations
 def get_product(db: Session, product_id: int):
     return db.query(models.Product).filter(models.Product.id == product_id).first()
 
-def get_products(db: Session):
-    return db.query(models.Product).all()
+def get_products(db: Session, limit: int = 50, cursor: str | None = None,
+                 min_price: float | None = None, max_price: float | None = None, in_stock: bool | None = None):
+    query = db.query(*serializers.for_schema(schemas.Product).columns(models.Product))
+    # the stock conditions are literal so they match the partial indexes'
+    if in_stock is True:
+        query = query.filter(models.Product.stock > literal_column("0"))
+    elif in_stock is False:
+        query = query.filter(models.Product.stock <= literal_column("0"))
+    if min_price is None and max_price is None:
+        return paginate(query, models.Product.id, limit, cursor)
+    # a price band is listed in (price, id) order, which ix_PRODUCTSTABLE_price_id
+    # serves without reading products outside the band
+    if max_price is not None:
+        query = query.filter(models.Product.price <= max_price)
+    return paginate_by_value(query, models.Product.price, models.Product.id, limit, cursor, minimum=min_price)
 
 def create_product(db: Session, product: schemas.ProductCreate):
     db_product = models.Product(**product.model_dump())
     db.add(db_product)
+    versions.bump(db, "catalog")
     db.commit()
     db.refresh(db_product)
+    catalog_cache.invalidate()
     return db_product
 
-def update_product(db: Session, product_id: int, product_update: schemas.ProductCreate):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if db_product:
-        db_product.name = product_update.name
-        db_product.description = product_update.description
-        db_product.price = product_update.price
-        db_product.stock = product_update.stock
-        db.commit()
-        db.refresh(db_product)
+def update_product(db: Session, product_id: int, product_update: schemas.ProductCreate | schemas.ProductUpdate):
+    values = product_update.model_dump(exclude_unset=True, exclude_none=True)
+    db_product = update_row(db, models.Product, schemas.Product, product_id, values, commit=False)
+    if db_product and values:
+        versions.bump(db, "catalog")
+    db.commit()
+    if db_product and values:
+        catalog_cache.invalidate()
     return db_product
 
 def delete_product(db: Session, product_id: int):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    db_product = delete_row(db, models.Product, schemas.Product, product_id, commit=False)
     if db_product:
-        db.delete(db_product)
-        db.commit()
+        versions.bump(db, "catalog")
+    db.commit()
+    if db_product:
+        catalog_cache.invalidate()
     return db_product
 
+def dialect_insert(db: Session):
+    # the INSERT construct with ON CONFLICT, for dialects that have one
+    return {"postgresql": postgresql.insert, "sqlite": sqlite.insert}.get(db.get_bind().dialect.name)
+
+def product_upsert_statement(db: Session, rows: list[dict]):
+    upsert = dialect_insert(db)
+    if upsert is None:
+        return None
+    stmt = upsert(models.Product).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Product.name],
+        set_={key: stmt.excluded[key] for key in ("description", "price", "stock")}
+    )
+
+def upsert_product_rows(db: Session, rows: list[dict]):
+    stmt = product_upsert_statement(db, rows)
+    if stmt is not None:
+        db.execute(stmt)
+        return
+    for row in rows:
+        db_product = db.query(models.Product).filter(models.Product.name == row["name"]).first()
+        if db_product is None:
+            db.add(models.Product(**row))
+        else:
+            for key, value in row.items():
+                setattr(db_product, key, value)
+    db.flush()
+
+def upsert_products(db: Session, rows: list[tuple[int, dict]]):
+    # rows are (row number, values) pairs; the chunk is one multi-row upsert in
+    # one transaction, and is retried row by row only if that fails. A name
+    # repeated within the chunk keeps its last row.
+    by_name = {}
+    for index, row in rows:
+        by_name[row["name"]] = (index, row)
+    errors = []
+    try:
+        upsert_product_rows(db, [row for _, row in by_name.values()])
+        versions.bump(db, "catalog")
+        db.commit()
+        upserted = len(by_name)
+    except SQLAlchemyError:
+        db.rollback()
+        upserted = 0
+        for index, row in by_name.values():
+            try:
+                upsert_product_rows(db, [row])
+                versions.bump(db, "catalog")
+                db.commit()
+                upserted += 1
+            except SQLAlchemyError as exc:
+                db.rollback()
+                errors.append({"row": index, "error": str(getattr(exc, "orig", None) or exc)})
+    catalog_cache.invalidate()
+    logger.info("Upserted %s products, %s failed", upserted, len(errors))
+    return upserted, errors
+
 # CartItem CRUD operations
-def get_cart_items(db: Session, user_id: int):
-    return db.query(models.CartItem).filter(models.CartItem.user_id == user_id).all()
+def get_cart_items(db: Session, user_id: int, limit: int = 50, cursor: str | None = None):
+    columns = serializers.for_schema(schemas.CartItem).columns(models.CartItem)
+    query = db.query(*columns).filter(models.CartItem.user_id == user_id)
+    return paginate(query, models.CartItem.id, limit, cursor)
+
+def get_cart_view(db: Session, user_id: int):
+    # one joined query for the whole cart, whatever its size
+    rows = (
+        db.query(models.CartItem.id, models.CartItem.product_id, models.CartItem.quantity,
+                 models.Product.name, models.Product.price, models.Product.stock)
+        .join(models.Product, models.Product.id == models.CartItem.product_id)
+        .filter(models.CartItem.user_id == user_id)
+        .order_by(models.CartItem.id)
+        .all()
+    )
+    items = [
+        {"id": item_id, "product_id": product_id, "quantity": quantity, "name": name,
+         "unit_price": price, "stock": stock, "line_total": price * quantity}
+        for item_id, product_id, quantity, name, price, stock in rows
+    ]
+    return {"user_id": user_id, "items": items, "item_count": sum(item["quantity"] for item in items),
+            "total_price": sum(item["line_total"] for item in items)}
 
 def add_item_to_cart(db: Session, cart_item: schemas.CartItemCreate, user_id: int):
-    db_cart_item = models.CartItem(**cart_item.dict(), user_id=user_id)
-    db.add(db_cart_item)
+    # a product already in the cart gets its quantity increased; the unique
+    # (user_id, product_id) index makes this one INSERT ... ON CONFLICT.
+    # Foreign keys are not enforced on SQLite, so the row is inserted from a
+    # SELECT that only yields it when the product exists.
+    columns = serializers.for_schema(schemas.CartItem).columns(models.CartItem)
+    values = dict(cart_item.model_dump(), user_id=user_id)
+    row = select(*(literal(value) for value in values.values())).where(
+        exists().where(models.Product.id == cart_item.product_id)
+    )
+    upsert = dialect_insert(db)
+    if upsert is not None:
+        stmt = upsert(models.CartItem).from_select(list(values), row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.CartItem.user_id, models.CartItem.product_id],
+            set_={"quantity": models.CartItem.quantity + stmt.excluded.quantity}
+        )
+        db_cart_item = db.execute(stmt.returning(*columns)).first()
+    else:
+        line = (models.CartItem.user_id == user_id, models.CartItem.product_id == cart_item.product_id)
+        result = db.execute(
+            update(models.CartItem).where(*line).values(quantity=models.CartItem.quantity + cart_item.quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if not result.rowcount:
+            db.execute(insert(models.CartItem).from_select(list(values), row))
+        db_cart_item = db.query(*columns).filter(*line).first()
+    if db_cart_item is None:
+        db.rollback()
+        raise CartError(f"Unknown product {cart_item.product_id}")
     db.commit()
-    db.refresh(db_cart_item)
     return db_cart_item
 
-def update_cart_item(db: Session, cart_item_id: int, cart_item_update: schemas.CartItemCreate):
-    db_cart_item = db.query(models.CartItem).filter(models.CartItem.id == cart_item_id).first()
-    if db_cart_item:
-        db_cart_item.quantity = cart_item_update.quantity
-        db_cart_item.product_id = cart_item_update.product_id
+def replace_cart(db: Session, user_id: int, items: list[schemas.CartItemCreate]):
+    # makes the cart exactly `items` in one transaction: one read of the
+    # wanted products and one of the current lines, then at most one DELETE,
+    # one batched UPDATE and one batched INSERT for the difference, whatever
+    # the cart size. Repeated products are summed and lines with quantity <= 0
+    # are dropped. Foreign keys are not enforced on SQLite, so unknown
+    # products are rejected here.
+    wanted = {}
+    for item in items:
+        wanted[item.product_id] = wanted.get(item.product_id, 0) + item.quantity
+    wanted = {product_id: quantity for product_id, quantity in wanted.items() if quantity > 0}
+    table = models.CartItem.__table__
+    try:
+        known = set(db.scalars(select(models.Product.id).where(models.Product.id.in_(wanted))))
+        unknown = sorted(set(wanted) - known)
+        if unknown:
+            raise CartError(f"Unknown product {', '.join(map(str, unknown))}")
+        current = {
+            product_id: (item_id, quantity)
+            for item_id, product_id, quantity in db.execute(
+                select(table.c.id, table.c.product_id, table.c.quantity).where(table.c.user_id == user_id)
+            )
+        }
+        removed = [item_id for product_id, (item_id, _) in current.items() if product_id not in wanted]
+        changed = [
+            {"line_id": current[product_id][0], "line_quantity": quantity}
+            for product_id, quantity in wanted.items()
+            if product_id in current and current[product_id][1] != quantity
+        ]
+        added = [
+            {"user_id": user_id, "product_id": product_id, "quantity": quantity}
+            for product_id, quantity in wanted.items() if product_id not in current
+        ]
+        if removed:
+            db.execute(delete(table).where(table.c.id.in_(removed)))
+        if changed:
+            db.execute(
+                update(table).where(table.c.id == bindparam("line_id")).values(quantity=bindparam("line_quantity")),
+                changed
+            )
+        if added:
+            db.execute(insert(table), added)
+        columns = serializers.for_schema(schemas.CartItem).columns(models.CartItem)
+        cart = db.query(*columns).filter(models.CartItem.user_id == user_id).order_by(models.CartItem.id).all()
         db.commit()
-        db.refresh(db_cart_item)
-    return db_cart_item
+    except Exception:
+        db.rollback()
+        raise
+    logger.info("Cart of user %s replaced: %s removed, %s changed, %s added",
+                user_id, len(removed), len(changed), len(added))
+    return cart
+
+def update_cart_item(db: Session, cart_item_id: int, cart_item_update: schemas.CartItemCreate | schemas.CartItemUpdate):
+    values = cart_item_update.model_dump(exclude_unset=True, exclude_none=True)
+    return update_row(db, models.CartItem, schemas.CartItem, cart_item_id, values)
 
 def delete_cart_item(db: Session, cart_item_id: int):
-    db_cart_item = db.query(models.CartItem).filter(models.CartItem.id == cart_item_id).first()
-    if db_cart_item:
-        db.delete(db_cart_item)
-        db.commit()
-    return db_cart_item
+    return delete_row(db, models.CartItem, schemas.CartItem, cart_item_id)
 
 # Purchase CRUD operations
 def get_purchase(db: Session, purchase_id: int):
     return db.query(models.Purchase).filter(models.Purchase.id == purchase_id).first()
 
-def get_purchases(db: Session, user_id: int):
-    return db.query(models.Purchase).filter(models.Purchase.user_id == user_id).all()
+def get_purchases(db: Session, user_id: int, limit: int = 50, cursor: str | None = None):
+    columns = serializers.for_schema(schemas.Purchase).columns(models.Purchase)
+    query = db.query(*columns).filter(models.Purchase.user_id == user_id)
+    return paginate(query, models.Purchase.id, limit, cursor)
+
+# purchase writes apply the same change to the sales aggregates before they
+# commit; new purchases also put a purchase.created event in the outbox
+def sale(purchase):
+    return purchase.user_id, purchase.product_id, purchase.created_at, purchase.quantity, purchase.total_price
+
+def purchase_created(user_id: int, purchases):
+    return {"user_id": user_id, "purchase_ids": [p.id for p in purchases],
+            "product_ids": [p.product_id for p in purchases],
+            "total_price": sum(p.total_price for p in purchases)}
 
 def create_purchase(db: Session, purchase: schemas.PurchaseCreate, user_id: int):
-    db_purchase = models.Purchase(**purchase.dict(), user_id=user_id)
+    db_purchase = models.Purchase(**purchase.model_dump(), user_id=user_id, created_at=sales.utcnow())
     db.add(db_purchase)
+    sales.record(db, [sale(db_purchase)])
+    db.flush()
+    outbox.enqueue(db, "purchase.created", purchase_created(user_id, [db_purchase]))
+    versions.bump(db, f"purchases:{user_id}")
     db.commit()
     db.refresh(db_purchase)
+    outbox.notify()
     return db_purchase
 
-def update_purchase(db: Session, purchase_id: int, purchase_update: schemas.PurchaseCreate):
-    db_purchase = db.query(models.Purchase).filter(models.Purchase.id == purchase_id).first()
-    if db_purchase:
-        db_purchase.total_price = purchase_update.total_price
-        db.commit()
-        db.refresh(db_purchase)
+def update_purchase(db: Session, purchase_id: int, purchase_update: schemas.PurchaseCreate | schemas.PurchaseUpdate):
+    values = purchase_update.model_dump(exclude_unset=True, exclude_none=True)
+    if not values:
+        return update_row(db, models.Purchase, schemas.Purchase, purchase_id, values)
+    # the old amounts come out of the aggregates, so read them under a row lock
+    old = (
+        db.query(models.Purchase.user_id, models.Purchase.product_id, models.Purchase.created_at,
+                 models.Purchase.quantity, models.Purchase.total_price)
+        .filter(models.Purchase.id == purchase_id)
+        .with_for_update()
+        .first()
+    )
+    if old is None:
+        db.rollback()
+        return None
+    db_purchase = update_row(db, models.Purchase, schemas.Purchase, purchase_id, values,
+                             extra=[models.Purchase.created_at], commit=False)
+    sales.record(db, [sale(db_purchase)], removed=[sale(old)])
+    versions.bump(db, f"purchases:{db_purchase.user_id}")
+    db.commit()
     return db_purchase
 
 def delete_purchase(db: Session, purchase_id: int):
-    db_purchase = db.query(models.Purchase).filter(models.Purchase.id == purchase_id).first()
+    db_purchase = delete_row(db, models.Purchase, schemas.Purchase, purchase_id,
+                             extra=[models.Purchase.created_at], commit=False)
     if db_purchase:
-        db.delete(db_purchase)
+        sales.record(db, removed=[sale(db_purchase)])
+        versions.bump(db, f"purchases:{db_purchase.user_id}")
+    db.commit()
+    return db_purchase
+
+def checkout(db: Session, user_id: int):
+    # one transaction: price the cart from PRODUCTSTABLE, empty the cart, take
+    # stock with conditional UPDATEs (stock >= quantity) so concurrent checkouts
+    # can never oversell, and write the purchases, their sales aggregates and
+    # outbox event
+    rows = (
+        db.query(models.CartItem.id, models.CartItem.product_id, models.CartItem.quantity, models.Product.price)
+        .join(models.Product, models.Product.id == models.CartItem.product_id)
+        .filter(models.CartItem.user_id == user_id)
+        .all()
+    )
+    if not rows:
+        raise CheckoutError("Cart is empty")
+    quantities = {}
+    prices = {}
+    for _, product_id, quantity, price in rows:
+        if quantity is None or quantity <= 0:
+            raise CheckoutError(f"Invalid quantity for product {product_id}")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        prices[product_id] = price
+    try:
+        # claiming the cart lines is the first write: a concurrent checkout of
+        # the same cart (double click, client retry) finds them gone and stops
+        # before it takes stock or writes purchases
+        claimed = db.execute(
+            delete(models.CartItem)
+            .where(models.CartItem.id.in_([row[0] for row in rows]))
+            .execution_options(synchronize_session=False)
+        )
+        if claimed.rowcount != len(rows):
+            raise CheckoutError("Cart was changed or checked out concurrently")
+        # a fixed update order keeps concurrent checkouts from deadlocking
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+            result = db.execute(
+                update(models.Product)
+                .where(models.Product.id == product_id, models.Product.stock >= quantity)
+                .values(stock=models.Product.stock - quantity)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                raise CheckoutError(f"Insufficient stock for product {product_id}")
+        now = sales.utcnow()
+        purchases = [
+            models.Purchase(user_id=user_id, product_id=product_id, quantity=quantity,
+                            total_price=prices[product_id] * quantity, created_at=now)
+            for product_id, quantity in quantities.items()
+        ]
+        db.add_all(purchases)
+        sales.record(db, [sale(purchase) for purchase in purchases])
+        db.flush()
+        outbox.enqueue(db, "purchase.created", purchase_created(user_id, purchases))
+        # stock changed, so the catalog did too
+        versions.bump(db, "catalog")
+        versions.bump(db, f"purchases:{user_id}")
         db.commit()
-    return db_purchase
\ No newline at end of file
+    except Exception:
+        db.rollback()
+        raise
+    catalog_cache.invalidate()
+    outbox.notify()
+    logger.info("User %s checked out %s products", user_id, len(purchases))
+    return purchases
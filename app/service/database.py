@@ -1,11 +1,200 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base, sessionmaker
-import os 
-from dotenv import load_dotenv
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+import itertools
+import os
+import threading
+import time
 
-load_dotenv()
+# Nothing here touches the database on import. init() reads the settings and
+# builds the engines; the app calls it from its lifespan, so every preforked
+# worker creates its own pools after the fork. Commands and scripts call it
+# directly.
 
-url = os.getenv('DATABASE_URL')
-engine = create_engine(url)
-sessionlocal = sessionmaker(autoflush=False, autocommit = False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+url = None
+use_async = False
+pool_size = 5
+max_overflow = 10
+pool_timeout = 30.0
+pool_recycle = 1800
+pool_pre_ping = True
+sqlite_pragmas = {}
+
+engine = None
+sessionlocal = None
+async_engine = None
+async_sessionlocal = None
+replica_urls = []
+replica_engines = []
+replica_sessionlocals = []
+async_replica_engines = []
+async_replica_sessionlocals = []
+_replica_counter = itertools.count()
+
+def env_flag(name: str, default: str):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+_pool_stats = {"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "timeouts": 0}
+_pool_stats_lock = threading.Lock()
+
+def record_checkout(started: float, timed_out: bool = False):
+    waited = time.perf_counter() - started
+    with _pool_stats_lock:
+        if timed_out:
+            _pool_stats["timeouts"] += 1
+            return
+        _pool_stats["checkouts"] += 1
+        _pool_stats["wait_seconds"] += waited
+        _pool_stats["max_wait_seconds"] = max(_pool_stats["max_wait_seconds"], waited)
+
+# QueuePool has no "before checkout" event, so the wait is timed around _do_get
+class TimedCheckout:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            record_checkout(started, timed_out=True)
+            raise
+        record_checkout(started)
+        return conn
+
+class TimedQueuePool(TimedCheckout, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+def is_sqlite(url: str):
+    return url.startswith("sqlite")
+
+def is_memory_sqlite(url: str):
+    return is_sqlite(url) and (":memory:" in url or url.rstrip("/") in ("sqlite:", "sqlite+aiosqlite:"))
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def engine_options(url: str, poolclass):
+    if is_memory_sqlite(url):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": pool_recycle,
+        "pool_pre_ping": pool_pre_ping,
+    }
+
+def make_engine(url: str):
+    new_engine = create_engine(url, **engine_options(url, TimedQueuePool))
+    if is_sqlite(url):
+        event.listen(new_engine, "connect", apply_sqlite_pragmas)
+    return new_engine
+
+def make_async_engine(url: str):
+    new_engine = create_async_engine(url, **engine_options(url, TimedAsyncQueuePool))
+    if is_sqlite(url):
+        event.listen(new_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    return new_engine
+
+def get_async_url(url: str):
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+def init():
+    global url, use_async, pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping, sqlite_pragmas
+    global engine, sessionlocal, async_engine, async_sessionlocal
+    global replica_urls, replica_engines, replica_sessionlocals, async_replica_engines, async_replica_sessionlocals
+    if engine is not None:
+        return
+    url = os.getenv('DATABASE_URL')
+    use_async = env_flag('USE_ASYNC_DB', 'true')
+    pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+    max_overflow = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    pool_recycle = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    pool_pre_ping = env_flag('DB_POOL_PRE_PING', 'true')
+    sqlite_pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+        "busy_timeout": int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
+    }
+
+    engine = make_engine(url)
+    sessionlocal = sessionmaker(autoflush=False, autocommit = False, bind=engine)
+    if use_async:
+        async_url = os.getenv('ASYNC_DATABASE_URL') or get_async_url(url)
+        async_engine = make_async_engine(async_url)
+        # objects are serialized after the handler returns, so they must not expire on commit
+        async_sessionlocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    # Read replicas. GET routes take sessions from get_read_sessionlocal(), which
+    # round-robins over DATABASE_REPLICA_URLS and falls back to the primary.
+    replica_urls = [u.strip() for u in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+    replica_engines = [make_engine(u) for u in replica_urls]
+    replica_sessionlocals = [sessionmaker(autoflush=False, autocommit = False, bind=e) for e in replica_engines]
+    if use_async:
+        async_replica_engines = [make_async_engine(get_async_url(u)) for u in replica_urls]
+        async_replica_sessionlocals = [async_sessionmaker(e, autoflush=False, expire_on_commit=False)
+                                       for e in async_replica_engines]
+
+def all_engines():
+    # sync engines (or the sync side of async ones), for event hooks
+    engines = [engine, *replica_engines]
+    engines += [e.sync_engine for e in [async_engine, *async_replica_engines] if e is not None]
+    return [e for e in engines if e is not None]
+
+async def dispose():
+    global engine, sessionlocal, async_engine, async_sessionlocal
+    global replica_engines, replica_sessionlocals, async_replica_engines, async_replica_sessionlocals
+    for async_replica in async_replica_engines:
+        await async_replica.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+    for replica in replica_engines:
+        replica.dispose()
+    if engine is not None:
+        engine.dispose()
+    engine = sessionlocal = async_engine = async_sessionlocal = None
+    replica_engines, replica_sessionlocals = [], []
+    async_replica_engines, async_replica_sessionlocals = [], []
+
+def get_write_sessionlocal():
+    return async_sessionlocal if use_async else sessionlocal
+
+def get_read_sessionlocal():
+    sessionlocals = async_replica_sessionlocals if use_async else replica_sessionlocals
+    if not sessionlocals:
+        return get_write_sessionlocal()
+    return sessionlocals[next(_replica_counter) % len(sessionlocals)]
+
+def get_read_engine():
+    engines = async_replica_engines if use_async else replica_engines
+    primary = async_engine if use_async else engine
+    if not engines:
+        return primary
+    return engines[next(_replica_counter) % len(engines)]
+
+def get_pool_stats():
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    active = async_engine.sync_engine if async_engine is not None else engine
+    pool = active.pool if active is not None else None
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                     saturation=round(pool.checkedout() / capacity, 3) if capacity else 0.0)
+    if stats["checkouts"]:
+        stats["avg_wait_seconds"] = stats["wait_seconds"] / stats["checkouts"]
+    return stats
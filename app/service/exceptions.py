@@ -0,0 +1,14 @@
+class CheckoutError(Exception):
+    pass
+
+class CartError(Exception):
+    pass
+
+class IdempotencyError(Exception):
+    pass
+
+class IdempotencyKeyReused(IdempotencyError):
+    pass
+
+class IdempotencyInProgress(IdempotencyError):
+    pass
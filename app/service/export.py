@@ -0,0 +1,67 @@
+from sqlalchemy import select
+import service.database as database
+import Models.models as models
+import csv
+import io
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rows are read with a server-side cursor (stream_results + yield_per) and
+# written out one chunk at a time, so memory stays flat regardless of table
+# size. The generators open their own session because the request scoped
+# session is closed before a streaming response starts sending.
+
+chunk_size = 1000
+
+product_columns = [models.Product.id, models.Product.name, models.Product.description,
+                   models.Product.price, models.Product.stock]
+purchase_columns = [models.Purchase.id, models.Purchase.user_id, models.Purchase.product_id,
+                    models.Purchase.quantity, models.Purchase.total_price]
+
+media_types = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def products_statement():
+    return select(*product_columns).order_by(models.Product.id)
+
+def purchases_statement(user_id: int | None = None):
+    stmt = select(*purchase_columns).order_by(models.Purchase.id)
+    if user_id is not None:
+        stmt = stmt.where(models.Purchase.user_id == user_id)
+    return stmt
+
+def format_chunk(rows, keys, fmt: str):
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+    return "".join(json.dumps(dict(zip(keys, row))) + "\n" for row in rows)
+
+def format_header(keys, fmt: str):
+    if fmt == "csv":
+        return format_chunk([keys], keys, fmt)
+    return ""
+
+def stream_sync(stmt, fmt: str):
+    keys = [c.key for c in stmt.selected_columns]
+    yield format_header(keys, fmt)
+    with database.get_read_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+        for rows in result.partitions():
+            yield format_chunk(rows, keys, fmt)
+
+async def stream_async(stmt, fmt: str):
+    keys = [c.key for c in stmt.selected_columns]
+    yield format_header(keys, fmt)
+    async with database.get_read_engine().connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=chunk_size))
+        async for rows in result.partitions():
+            yield format_chunk(rows, keys, fmt)
+
+def stream(stmt, fmt: str):
+    logger.info("Streaming %s export", fmt)
+    if database.use_async:
+        return stream_async(stmt, fmt)
+    # starlette iterates sync generators in its threadpool
+    return stream_sync(stmt, fmt)
@@ -0,0 +1,130 @@
+from datetime import timedelta
+from typing import NamedTuple
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import Models.models as models
+import service.async_crud as async_crud
+import service.sales as sales
+from service.cache import TTLCache
+from service.exceptions import IdempotencyInProgress, IdempotencyKeyReused
+import asyncio
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Idempotency-Key support for retried writes. The first successful response
+# for a key is stored in IDEMPOTENCY_KEYS, with an in-process LRU in front of
+# it, for IDEMPOTENCY_TTL seconds. A replay with the same key and request
+# body gets the stored response without running the write again. Keys are
+# scoped to the user and route by the caller.
+#
+# Before the write runs, the key is claimed with a pending row. Concurrent
+# requests with the key in the same process wait for the first one, and
+# another process holding the claim gets IdempotencyInProgress. A claim left
+# behind by a crash can be taken over after IDEMPOTENCY_PENDING_SECONDS.
+# Failed writes release their claim, so only successes are replayed.
+#
+#   IDEMPOTENCY_TTL              seconds a stored response is replayed (default one day)
+#   IDEMPOTENCY_PENDING_SECONDS  age at which an unfinished claim is considered abandoned
+#   IDEMPOTENCY_CACHE_SIZE       responses kept in the in-process LRU
+
+ttl_seconds = float(os.getenv('IDEMPOTENCY_TTL', 86400))
+pending_seconds = float(os.getenv('IDEMPOTENCY_PENDING_SECONDS', 30))
+responses = TTLCache(maxsize=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000)), ttl=min(ttl_seconds, 300))
+
+_inflight = {}
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: bytes
+
+def fingerprint(body: bytes):
+    return hashlib.sha256(body).hexdigest()
+
+def claim(db: Session, key: str, request_fingerprint: str):
+    # returns None when this caller now owns the key, else the existing row
+    now = sales.utcnow()
+    table = models.IdempotencyKey
+    abandoned = table.status_code.is_(None) & (table.created_at <= now - timedelta(seconds=pending_seconds))
+    db.execute(delete(table).where(table.key == key, (table.expires_at <= now) | abandoned))
+    db.add(table(key=key, fingerprint=request_fingerprint, created_at=now,
+                 expires_at=now + timedelta(seconds=ttl_seconds)))
+    try:
+        db.commit()
+        return None
+    except IntegrityError:
+        db.rollback()
+    return db.query(table.fingerprint, table.status_code, table.body).filter(table.key == key).first()
+
+def complete(db: Session, key: str, status_code: int, body: bytes):
+    db.execute(update(models.IdempotencyKey).where(models.IdempotencyKey.key == key)
+               .values(status_code=status_code, body=body))
+    db.commit()
+
+def release(db: Session, key: str):
+    # the failed write may have left the session mid-transaction
+    db.rollback()
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.key == key))
+    db.commit()
+
+def purge(db: Session):
+    result = db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= sales.utcnow()))
+    db.commit()
+    return result.rowcount
+
+def replay(stored: StoredResponse, request_fingerprint: str):
+    if stored.fingerprint != request_fingerprint:
+        raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+    return stored
+
+async def execute(db, key: str, request_fingerprint: str, call):
+    """Run call() at most once per key and return (StoredResponse, replayed).
+
+    call is an async function returning (status_code, body bytes).
+    """
+    stored = responses.get(key)
+    if stored is not None:
+        return replay(stored, request_fingerprint), True
+    waiting = _inflight.get(key)
+    if waiting is not None:
+        return replay(await asyncio.shield(waiting), request_fingerprint), True
+
+    future = asyncio.get_running_loop().create_future()
+    # retrieve the exception so a failure nobody waited for is not logged as unhandled
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[key] = future
+    try:
+        existing = await async_crud.run(db, claim, key, request_fingerprint)
+        if existing is not None:
+            if existing.status_code is None:
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+            stored = StoredResponse(existing.fingerprint, existing.status_code, existing.body)
+            responses.set(key, stored)
+            future.set_result(stored)
+            return replay(stored, request_fingerprint), True
+        try:
+            status_code, body = await call()
+        except BaseException:
+            await async_crud.run(db, release, key)
+            raise
+        stored = StoredResponse(request_fingerprint, status_code, body)
+        await async_crud.run(db, complete, key, status_code, body)
+        responses.set(key, stored)
+        future.set_result(stored)
+        return stored, False
+    except BaseException as exc:
+        if not future.done():
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+def get_stats():
+    return {**responses.stats(), "in_flight": len(_inflight)}
@@ -0,0 +1,139 @@
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import os
+import threading
+import time
+
+# Per-route latency histograms and per-request database counters, rendered in
+# the Prometheus text format at /metrics. Query counts are collected by engine
+# event hooks into a per-request object held in a ContextVar; SQLAlchemy's
+# async greenlets inherit the caller's context, so run_sync queries count too.
+
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+debug_headers = os.getenv('METRICS_DEBUG_HEADERS', 'false').lower() in ('1', 'true', 'yes')
+
+_request_stats: ContextVar = ContextVar("request_stats", default=None)
+_lock = threading.Lock()
+_routes = {}
+_gauges = {}
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+def current_stats():
+    return _request_stats.get()
+
+# The start time is kept on the statement's execution context rather than
+# the pooled connection, so a statement that fails leaves nothing behind;
+# failed statements are counted through handle_error.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_query_start = time.perf_counter()
+
+def _record(context):
+    started = getattr(context, "metrics_query_start", None)
+    if started is None:
+        return
+    context.metrics_query_start = None
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record(context)
+
+def _handle_error(exception_context):
+    _record(exception_context.execution_context)
+
+def instrument_engine(engine: Engine):
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+def observe(method: str, route: str, status: int, seconds: float, stats: RequestStats):
+    key = (method, route)
+    with _lock:
+        entry = _routes.get(key)
+        if entry is None:
+            entry = _routes[key] = {"buckets": [0] * len(buckets), "count": 0, "sum": 0.0,
+                                    "queries": 0, "db_time": 0.0, "errors": 0}
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+                break
+        entry["count"] += 1
+        entry["sum"] += seconds
+        entry["queries"] += stats.queries
+        entry["db_time"] += stats.db_time
+        if status >= 500:
+            entry["errors"] += 1
+
+def register_gauges(name: str, collect):
+    # collect() returns a flat dict of numbers, exported as <name>_<key>
+    _gauges[name] = collect
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+        add_headers = debug_headers or any(name == b"x-debug-queries" for name, _ in scope["headers"])
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if add_headers:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-query-count", str(stats.queries).encode()),
+                        (b"x-db-time-ms", f"{stats.db_time * 1000:.2f}".encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            observe(scope["method"], path, status_code, time.perf_counter() - started, stats)
+            _request_stats.reset(token)
+
+def render():
+    lines = [
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    with _lock:
+        routes = {key: dict(entry, buckets=list(entry["buckets"])) for key, entry in _routes.items()}
+    for (method, route), entry in sorted(routes.items()):
+        labels = f'method="{method}",route="{route}"'
+        cumulative = 0
+        for bound, count in zip(buckets, entry["buckets"]):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {entry["sum"]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {entry["count"]}')
+    for name, kind in (("queries", "db_queries_total"), ("db_time", "db_query_seconds_total"),
+                       ("errors", "http_request_errors_total")):
+        lines.append(f"# TYPE {kind} counter")
+        for (method, route), entry in sorted(routes.items()):
+            lines.append(f'{kind}{{method="{method}",route="{route}"}} {entry[name]}')
+    for name, collect in sorted(_gauges.items()):
+        for key, value in sorted(collect().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {name}_{key} gauge")
+                lines.append(f"{name}_{key} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,231 @@
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, event, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import service.database as database
+import Models.models as models  # registers the model tables on Base.metadata
+import service.sales as sales
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Versioned schema migrations. Each migration runs once, in order, and is
+# recorded in schema_migrations. Migrations are written to be idempotent so a
+# fresh database (where 0001 already creates the current schema) and an old
+# one both end up in the same state.
+
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+def create_tables(conn):
+    database.Base.metadata.create_all(bind=conn)
+
+def create_index(conn, name: str, table: str, *columns: str, unique: bool = False, where: str | None = None):
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} ({', '.join(quote(c) for c in columns)})"
+        + (f" WHERE {where}" if where else "")
+    ))
+
+def drop_index(conn, name: str):
+    conn.execute(text(f"DROP INDEX IF EXISTS {conn.dialect.identifier_preparer.quote(name)}"))
+
+def foreign_key_indexes(conn):
+    create_index(conn, "ix_CART_ITEMS_user_id_product_id", "CART_ITEMS", "user_id", "product_id")
+    create_index(conn, "ix_CART_ITEMS_product_id", "CART_ITEMS", "product_id")
+    create_index(conn, "ix_PURCHASE_user_id_id", "PURCHASE", "user_id", "id")
+    create_index(conn, "ix_PURCHASE_product_id", "PURCHASE", "product_id")
+    create_index(conn, "ix_PRODUCTSTABLE_price", "PRODUCTSTABLE", "price")
+    # nothing filters on description
+    drop_index(conn, "ix_PRODUCTSTABLE_description")
+
+sqlite_search_ddl = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "name, description, content='PRODUCTSTABLE', content_rowid='id', prefix='2 3')",
+    'CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON "PRODUCTSTABLE" BEGIN '
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    'CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON "PRODUCTSTABLE" BEGIN '
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    'CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON "PRODUCTSTABLE" BEGIN '
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+]
+
+postgres_search_ddl = [
+    'ALTER TABLE "PRODUCTSTABLE" ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ('
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED",
+    'CREATE INDEX IF NOT EXISTS "ix_PRODUCTSTABLE_search_vector" ON "PRODUCTSTABLE" USING GIN (search_vector)',
+]
+
+def product_search(conn):
+    statements = {"sqlite": sqlite_search_ddl, "postgresql": postgres_search_ddl}.get(conn.dialect.name, [])
+    for statement in statements:
+        conn.execute(text(statement))
+
+def unique_cart_lines(conn):
+    # fold duplicate (user_id, product_id) rows into the oldest one, then make
+    # the pair unique so adds can upsert on it
+    conn.execute(text(
+        'UPDATE "CART_ITEMS" SET quantity = (SELECT SUM(c.quantity) FROM "CART_ITEMS" c '
+        'WHERE c.user_id = "CART_ITEMS".user_id AND c.product_id = "CART_ITEMS".product_id) '
+        'WHERE id IN (SELECT MIN(id) FROM "CART_ITEMS" WHERE user_id IS NOT NULL AND product_id IS NOT NULL '
+        'GROUP BY user_id, product_id HAVING COUNT(*) > 1)'
+    ))
+    conn.execute(text(
+        'DELETE FROM "CART_ITEMS" WHERE user_id IS NOT NULL AND product_id IS NOT NULL AND id NOT IN '
+        '(SELECT MIN(id) FROM "CART_ITEMS" WHERE user_id IS NOT NULL AND product_id IS NOT NULL '
+        'GROUP BY user_id, product_id)'
+    ))
+    drop_index(conn, "ix_CART_ITEMS_user_id_product_id")
+    create_index(conn, "ix_CART_ITEMS_user_id_product_id", "CART_ITEMS", "user_id", "product_id", unique=True)
+
+def add_column(conn, table: str, column: str, ddl_type: str):
+    if column in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {ddl_type}"))
+
+def sales_aggregates(conn):
+    # purchases made before this have no date and count as one unit; they
+    # stay out of DAILY_SALES
+    add_column(conn, "PURCHASE", "quantity", "INTEGER")
+    add_column(conn, "PURCHASE", "created_at", "TIMESTAMP")
+    conn.execute(text('UPDATE "PURCHASE" SET quantity = 1 WHERE quantity IS NULL'))
+    tables = [models.ProductSales.__table__, models.UserSales.__table__, models.DailySales.__table__]
+    database.Base.metadata.create_all(bind=conn, tables=tables)
+    sales.recompute(conn)
+
+def outbox(conn):
+    database.Base.metadata.create_all(bind=conn, tables=[models.OutboxEvent.__table__])
+
+def idempotency_keys(conn):
+    database.Base.metadata.create_all(bind=conn, tables=[models.IdempotencyKey.__table__])
+
+def cart_order_index(conn):
+    # 0002 used to drop this index, but cart pages and the cart view read a
+    # user's lines in id order
+    create_index(conn, "ix_CART_ITEMS_user_id_id", "CART_ITEMS", "user_id", "id")
+
+def resource_versions(conn):
+    database.Base.metadata.create_all(bind=conn, tables=[models.ResourceVersion.__table__])
+
+def product_filter_indexes(conn):
+    # price filters page on (price, id) instead of walking the primary key
+    create_index(conn, "ix_PRODUCTSTABLE_price_id", "PRODUCTSTABLE", "price", "id")
+    drop_index(conn, "ix_PRODUCTSTABLE_price")
+    create_index(conn, "ix_PRODUCTSTABLE_in_stock", "PRODUCTSTABLE", "id", where="stock > 0")
+    create_index(conn, "ix_PRODUCTSTABLE_out_of_stock", "PRODUCTSTABLE", "id", where="stock <= 0")
+
+migrations = [
+    (1, "create_tables", create_tables),
+    (2, "foreign_key_indexes", foreign_key_indexes),
+    (3, "product_search", product_search),
+    (4, "unique_cart_lines", unique_cart_lines),
+    (5, "sales_aggregates", sales_aggregates),
+    (6, "outbox", outbox),
+    (7, "idempotency_keys", idempotency_keys),
+    (8, "cart_order_index", cart_order_index),
+    (9, "resource_versions", resource_versions),
+    (10, "product_filter_indexes", product_filter_indexes),
+]
+
+def current_version(conn):
+    migration_metadata.create_all(bind=conn)
+    return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+def upgrade(engine: Engine):
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for number, name, migrate in migrations:
+        if number <= version:
+            continue
+        logger.info("Applying migration %04d %s", number, name)
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(schema_migrations.insert().values(version=number, name=name))
+    return max(number for number, _, _ in migrations)
+
+# Hot paths whose SQLite plans must come from an index. check_query_plans
+# runs each through the functions the app calls, in a transaction it rolls
+# back, and explains every statement they send. A paged query must also walk
+# its key in order: a USE TEMP B-TREE sort there costs as much as all the
+# rows the filter matches, not one page. A filtered listing names the index
+# its filter needs, since walking the primary key and testing every row
+# ("USING INTEGER PRIMARY KEY (rowid>?)") is neither a SCAN nor a sort.
+def hot_queries():
+    import service.crud as crud
+    import service.search as search
+    import service.outbox as outbox
+    from service.pagination import encode_cursor, encode_score_cursor
+
+    after = encode_cursor(1)
+    after_price = encode_score_cursor(15, 1)
+    # name: (call, paged, index the plan must use)
+    return {
+        "users_page": (lambda db: crud.get_users(db, 50, after), True, None),
+        "user_by_name": (lambda db: crud.get_user_by_username(db, "x"), False, None),
+        "products_first_page": (lambda db: crud.get_products(db, 50), True, None),
+        "products_page": (lambda db: crud.get_products(db, 50, after), True, None),
+        "products_by_price": (lambda db: crud.get_products(db, 50, None, 10, 20), True,
+                              "ix_PRODUCTSTABLE_price_id"),
+        "products_by_price_page": (lambda db: crud.get_products(db, 50, after_price, 10, 20), True,
+                                   "ix_PRODUCTSTABLE_price_id"),
+        "products_in_stock_page": (lambda db: crud.get_products(db, 50, after, in_stock=True), True,
+                                   "ix_PRODUCTSTABLE_in_stock"),
+        "products_out_of_stock_page": (lambda db: crud.get_products(db, 50, after, in_stock=False), True,
+                                       "ix_PRODUCTSTABLE_out_of_stock"),
+        "cart_first_page": (lambda db: crud.get_cart_items(db, 1, 50), True, "ix_CART_ITEMS_user_id_id"),
+        "cart_page": (lambda db: crud.get_cart_items(db, 1, 50, after), True, "ix_CART_ITEMS_user_id_id"),
+        "cart_view": (lambda db: crud.get_cart_view(db, 1), False, "ix_CART_ITEMS_user_id_id"),
+        "purchases_page": (lambda db: crud.get_purchases(db, 1, 50, after), True, "ix_PURCHASE_user_id_id"),
+        # ranked by score, so sorting its candidate window is expected
+        "product_search": (lambda db: search.search_products(db, "lap", 20), False, None),
+        "outbox_claim": (lambda db: outbox.claim(db, outbox.batch_size), False, None),
+    }
+
+def plan_failed(plan: list[str], paged: bool, index: str | None):
+    # FTS5 lookups show up as "SCAN ... VIRTUAL TABLE INDEX", which is an index
+    # probe, and a scan of a materialized (already bounded) subquery is fine
+    materialized = {step.split()[1] for step in plan if step.startswith(("MATERIALIZE", "CO-ROUTINE"))}
+    for step in plan:
+        if step.startswith("SCAN") and "VIRTUAL TABLE INDEX" not in step and step.split()[1] not in materialized:
+            return True
+        if paged and step.startswith("USE TEMP B-TREE"):
+            return True
+    return index is not None and not any(f"INDEX {index} " in f"{step} " for step in plan)
+
+def check_query_plans(engine: Engine):
+    if engine.dialect.name != "sqlite":
+        logger.info("Query plan check only runs on SQLite")
+        return {}
+    failures = {}
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    with engine.connect() as conn:
+        event.listen(conn, "before_cursor_execute", capture)
+        for name, (call, paged, index) in hot_queries().items():
+            statements.clear()
+            transaction = conn.begin()
+            try:
+                # the session joins the transaction, so its commits stay in it
+                with Session(bind=conn) as db:
+                    call(db)
+                sent = list(statements)
+                plan = [row[-1] for statement, parameters in sent
+                        for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            finally:
+                transaction.rollback()
+            if plan_failed(plan, paged, index):
+                failures[name] = plan
+    return failures
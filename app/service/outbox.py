@@ -0,0 +1,227 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from sqlalchemy import and_, func, select, update, delete
+from sqlalchemy.orm import Session
+import Models.models as models
+import Auth.depends as depends
+import service.database as database
+import service.async_crud as async_crud
+import service.sales as sales
+import asyncio
+import json
+import logging
+import os
+import random
+
+logger = logging.getLogger(__name__)
+audit_logger = logging.getLogger("audit")
+
+# Transactional outbox. Write paths call enqueue() inside their own
+# transaction, so an event exists if and only if the change committed, and
+# the follow-up work runs after the response instead of before it.
+#
+# start() (from the app lifespan) runs one poller and OUTBOX_WORKERS worker
+# tasks. The poller claims due events in batches by pushing their
+# available_at forward by a lease, so several processes can drain the same
+# table. A worker hands the event to the outbox thread pool, where every
+# handler for its topic runs and the event is deleted in one transaction on
+# the thread's own sync session; handlers are plain blocking functions and
+# never hold up the event loop. On failure the event is retried with exponential
+# backoff and jitter, and after OUTBOX_MAX_ATTEMPTS it is parked with
+# failed_at set. Handlers must be idempotent, since a lease can expire
+# while its event is still being processed.
+#
+#   OUTBOX_WORKERS        concurrent handler threads per process (0 disables the pool)
+#   OUTBOX_BATCH_SIZE     events claimed per poll
+#   OUTBOX_POLL_SECONDS   idle poll interval; enqueue also wakes the poller
+#   OUTBOX_LEASE_SECONDS  how long a claimed event is hidden from other pollers
+#   OUTBOX_MAX_ATTEMPTS   attempts before an event is parked
+
+workers = int(os.getenv('OUTBOX_WORKERS', 4))
+batch_size = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+poll_seconds = float(os.getenv('OUTBOX_POLL_SECONDS', 1.0))
+lease_seconds = float(os.getenv('OUTBOX_LEASE_SECONDS', 60))
+max_attempts = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+backoff_base = 1.0
+backoff_cap = 300.0
+
+handlers = {}
+
+_tasks = []
+_executor = None
+_queue = None
+_wakeup = None
+_stats = {"enqueued": 0, "processed": 0, "retried": 0, "failed": 0, "in_flight": 0, "depth": 0,
+          "oldest_created_at": None}
+
+def handler(topic: str):
+    def register(callback):
+        handlers.setdefault(topic, []).append(callback)
+        return callback
+    return register
+
+def enqueue(db: Session, topic: str, payload: dict):
+    # the caller commits; notify() after the commit wakes the poller early
+    now = sales.utcnow()
+    db.add(models.OutboxEvent(topic=topic, payload=json.dumps(payload), attempts=0,
+                              created_at=now, available_at=now))
+    _stats["enqueued"] += 1
+
+def notify():
+    if _wakeup is not None:
+        _wakeup.set()
+
+def backoff(attempts: int):
+    return min(backoff_cap, backoff_base * 2 ** attempts) * random.uniform(0.5, 1.0)
+
+def claim(db: Session, limit: int):
+    # one UPDATE ... RETURNING both selects and leases a batch; SKIP LOCKED
+    # keeps concurrent pollers on PostgreSQL from waiting on each other
+    now = sales.utcnow()
+    table = models.OutboxEvent.__table__
+    due = and_(table.c.failed_at.is_(None), table.c.available_at <= now)
+    ids = select(table.c.id).where(due).order_by(table.c.id).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        ids = ids.with_for_update(skip_locked=True)
+    columns = (table.c.id, table.c.topic, table.c.payload, table.c.attempts)
+    lease = {"available_at": now + timedelta(seconds=lease_seconds)}
+    if getattr(db.get_bind().dialect, "update_returning", False):
+        stmt = update(table).where(table.c.id.in_(ids.scalar_subquery()), due).values(**lease)
+        events = db.execute(stmt.returning(*columns)).all()
+    else:
+        events = db.execute(select(*columns).where(table.c.id.in_(ids.scalar_subquery()))).all()
+        if events:
+            db.execute(update(table).where(table.c.id.in_([event.id for event in events])).values(**lease))
+    depth, oldest = db.execute(select(func.count(table.c.id), func.min(table.c.created_at))
+                               .where(table.c.failed_at.is_(None))).one()
+    db.commit()
+    _stats["depth"], _stats["oldest_created_at"] = depth, oldest
+    return sorted(events, key=lambda event: event.id)
+
+def handle(db: Session, event_id: int, topic: str, payload: dict):
+    try:
+        for callback in handlers.get(topic, []):
+            callback(db, payload)
+        db.execute(delete(models.OutboxEvent).where(models.OutboxEvent.id == event_id))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def run_handlers(event_id: int, topic: str, payload: dict):
+    # runs on an outbox thread
+    db = database.sessionlocal()
+    try:
+        handle(db, event_id, topic, payload)
+    finally:
+        db.close()
+
+def reschedule(db: Session, event_id: int, attempts: int, error: str):
+    now = sales.utcnow()
+    values = {"attempts": attempts, "last_error": error[:1000]}
+    if attempts >= max_attempts:
+        values["failed_at"] = now
+    else:
+        values["available_at"] = now + timedelta(seconds=backoff(attempts))
+    db.execute(update(models.OutboxEvent).where(models.OutboxEvent.id == event_id).values(**values))
+    db.commit()
+    return "failed_at" in values
+
+async def process(event):
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_executor, run_handlers, event.id, event.topic, json.loads(event.payload))
+        _stats["processed"] += 1
+    except Exception as exc:
+        attempts = event.attempts + 1
+        async with depends.session_scope(database.get_write_sessionlocal()) as db:
+            parked = await async_crud.run(db, reschedule, event.id, attempts, repr(exc))
+        if parked:
+            _stats["failed"] += 1
+            logger.error("Outbox event %s (%s) failed after %s attempts: %r", event.id, event.topic, attempts, exc)
+        else:
+            _stats["retried"] += 1
+            logger.warning("Outbox event %s (%s) attempt %s failed: %r", event.id, event.topic, attempts, exc)
+
+async def poll():
+    while True:
+        events = []
+        try:
+            async with depends.session_scope(database.get_write_sessionlocal()) as db:
+                events = await async_crud.run(db, claim, batch_size)
+        except Exception:
+            logger.exception("Outbox poll failed")
+        for event in events:
+            # a full queue holds the poller back until a worker is free
+            await _queue.put(event)
+        if len(events) < batch_size:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+
+async def work():
+    while True:
+        event = await _queue.get()
+        _stats["in_flight"] += 1
+        try:
+            await process(event)
+        except Exception:
+            logger.exception("Outbox event %s could not be rescheduled", event.id)
+        finally:
+            _stats["in_flight"] -= 1
+            _queue.task_done()
+
+async def start():
+    global _executor, _queue, _wakeup
+    if workers <= 0 or _tasks:
+        return
+    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+    _queue = asyncio.Queue(maxsize=batch_size)
+    _wakeup = asyncio.Event()
+    _tasks.append(asyncio.create_task(poll()))
+    _tasks.extend(asyncio.create_task(work()) for _ in range(workers))
+    logger.info("Outbox started with %s workers", workers)
+
+async def stop():
+    # events still queued keep their lease and are picked up again after it;
+    # a handler already running on a thread finishes in the background
+    global _executor, _queue, _wakeup
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = _queue = _wakeup = None
+
+def get_stats():
+    stats = dict(_stats)
+    oldest = stats.pop("oldest_created_at")
+    stats["lag_seconds"] = (sales.utcnow() - oldest).total_seconds() if oldest is not None else 0.0
+    stats["queued"] = _queue.qsize() if _queue is not None else 0
+    return stats
+
+# Handlers for purchases. Each receives the handler's session and the
+# payload; whatever it writes commits together with the event's deletion.
+
+@handler("purchase.created")
+def audit_purchase(db: Session, payload: dict):
+    audit_logger.info("purchase user=%s purchases=%s total=%s", payload["user_id"],
+                      payload["purchase_ids"], payload["total_price"])
+
+@handler("purchase.created")
+def reconcile_stock(db: Session, payload: dict):
+    # stock is taken with conditional UPDATEs, so a negative level means
+    # something wrote PRODUCTSTABLE outside checkout
+    product_ids = [product_id for product_id in payload.get("product_ids", []) if product_id is not None]
+    if not product_ids:
+        return
+    oversold = (
+        db.query(models.Product.id, models.Product.stock)
+        .filter(models.Product.id.in_(product_ids), models.Product.stock < 0)
+        .all()
+    )
+    for product_id, stock in oversold:
+        logger.error("Product %s has negative stock %s after purchase by user %s", product_id, stock, payload["user_id"])
@@ -0,0 +1,64 @@
+import base64
+
+# Keyset pagination over an indexed integer column. The cursor is the last
+# primary key of the previous page, base64 encoded so clients treat it as
+# opaque; no OFFSET is ever issued.
+
+def encode_cursor(last_id: int):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str | None):
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+# Ranked results (search) and price bands page on (value, id) instead of id
+# alone.
+def encode_score_cursor(score: float, last_id: int):
+    value = f"{score!r}:{last_id}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+def decode_score_cursor(cursor: str | None):
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, last_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":")
+        return float(score), int(last_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def paginate(query, column, limit: int, cursor: str | None = None):
+    after_id = decode_cursor(cursor)
+    # the first page gets a lower bound too, so every page walks the key in
+    # order rather than letting a filter's index pick the rows and sort them
+    query = query.filter(column > (after_id if after_id is not None else 0))
+    rows = query.order_by(column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], column.key))
+    return rows, next_cursor
+
+def paginate_by_value(query, column, id_column, limit: int, cursor: str | None = None, minimum=None):
+    # pages in (column, id) order, for filters on column served by a
+    # (column, id) index. The cursor's value and `minimum` are folded into
+    # one lower bound: given two, SQLite seeks on the filter's and walks
+    # every row before the cursor.
+    after = decode_score_cursor(cursor)
+    if after is not None:
+        value, last_id = after
+        minimum = value if minimum is None else max(minimum, value)
+        query = query.filter((column > value) | (id_column > last_id))
+    if minimum is not None:
+        query = query.filter(column >= minimum)
+    rows = query.order_by(column, id_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_score_cursor(getattr(rows[-1], column.key), getattr(rows[-1], id_column.key))
+    return rows, next_cursor
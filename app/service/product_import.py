@@ -0,0 +1,141 @@
+from collections import deque
+from typing import NamedTuple
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+import Schemas.schemas as schemas
+import service.crud as crud
+import service.async_crud as async_crud
+import codecs
+import csv
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+chunk_size = int(os.getenv('IMPORT_CHUNK_SIZE', 1000))
+
+class RowError(NamedTuple):
+    # a source row that could not be turned into a product dict
+    error: str
+
+def new_report():
+    return {"received": 0, "upserted": 0, "errors": [], "seconds": 0.0, "rows_per_second": 0.0,
+            "_started": time.perf_counter()}
+
+def finish_report(report: dict):
+    report["seconds"] = round(time.perf_counter() - report.pop("_started"), 3)
+    if report["seconds"] > 0:
+        report["rows_per_second"] = round(report["received"] / report["seconds"], 1)
+    logger.info("Imported %s of %s products in %ss (%s rows/s)",
+                report["upserted"], report["received"], report["seconds"], report["rows_per_second"])
+    return report
+
+def validate_row(index: int, row: dict, report: dict):
+    report["received"] += 1
+    if isinstance(row, RowError):
+        report["errors"].append({"row": index, "error": row.error})
+        return None
+    try:
+        return schemas.ProductCreate.model_validate(row).model_dump()
+    except ValidationError as exc:
+        report["errors"].append({"row": index, "error": str(exc)})
+        return None
+
+def record_chunk(report: dict, result):
+    upserted, errors = result
+    report["upserted"] += upserted
+    report["errors"].extend(errors)
+
+def import_rows(db: Session, rows):
+    report = new_report()
+    chunk = []
+    for index, row in enumerate(rows):
+        values = validate_row(index, row, report)
+        if values is not None:
+            chunk.append((index, values))
+        if len(chunk) >= chunk_size:
+            record_chunk(report, crud.upsert_products(db, chunk))
+            chunk = []
+    if chunk:
+        record_chunk(report, crud.upsert_products(db, chunk))
+    return finish_report(report)
+
+async def import_rows_async(db, rows):
+    report = new_report()
+    chunk = []
+    index = 0
+    async for row in rows:
+        values = validate_row(index, row, report)
+        if values is not None:
+            chunk.append((index, values))
+        if len(chunk) >= chunk_size:
+            record_chunk(report, await async_crud.upsert_products(db, chunk))
+            chunk = []
+        index += 1
+    if chunk:
+        record_chunk(report, await async_crud.upsert_products(db, chunk))
+    return finish_report(report)
+
+async def iter_list(rows: list):
+    for row in rows:
+        yield row
+
+def split_lines(text: str):
+    # complete lines keep their endings and the unterminated tail is returned
+    # separately. Only "\n" ends a line: str.splitlines() would also break at
+    # characters such as U+2028 that can appear inside a field.
+    lines = text.split("\n")
+    tail = lines.pop()
+    return [line + "\n" for line in lines], tail
+
+async def iter_csv_stream(stream):
+    # decode the request body incrementally and feed its lines to a single
+    # csv.reader, so a quoted field may span lines and chunks. The reader is
+    # only advanced once every quote in the buffered lines is closed, which
+    # means the lines it will ask for have all arrived.
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    lines = deque()
+
+    def feed():
+        while lines:
+            yield lines.popleft()
+
+    reader = csv.reader(feed())
+    header = None
+    pending = ""
+    quotes = 0
+
+    def parse():
+        nonlocal reader, header
+        while lines:
+            try:
+                values = next(reader)
+            except StopIteration:
+                # malformed quoting ran the reader past the buffered lines;
+                # the rest is parsed by a fresh one
+                reader = csv.reader(feed())
+                continue
+            if not values:
+                continue
+            if header is None:
+                header = values
+            elif len(values) != len(header):
+                yield RowError(f"expected {len(header)} columns, got {len(values)}")
+            else:
+                yield dict(zip(header, values))
+
+    async for data in stream:
+        complete, pending = split_lines(pending + decoder.decode(data))
+        for line in complete:
+            lines.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                quotes = 0
+                for row in parse():
+                    yield row
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        lines.append(pending)
+    for row in parse():
+        yield row
@@ -0,0 +1,125 @@
+from datetime import date, datetime, timezone
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+import Models.models as models
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sales aggregates. PRODUCT_SALES, USER_SALES and DAILY_SALES hold units,
+# revenue and purchase counts per product, per user and per day. crud applies
+# each purchase write to them as deltas inside the same transaction, so
+# reports read a handful of rows instead of grouping PURCHASE. rebuild()
+# recomputes them from PURCHASE for backfills (`python cli.py rebuild-sales`).
+#
+# A purchase is the tuple (user_id, product_id, created_at, quantity, revenue).
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _day(created_at):
+    return created_at.date() if created_at is not None else None
+
+def _upsert(db: Session, model, key: str, deltas: dict):
+    # deltas maps key value -> [units, revenue, purchases]; one multi-row
+    # INSERT ... ON CONFLICT per table, or UPDATE-then-INSERT per key elsewhere
+    if not deltas:
+        return
+    rows = [{key: value, "units": units, "revenue": revenue, "purchases": purchases}
+            for value, (units, revenue, purchases) in deltas.items()]
+    dialect_insert = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(model).values(rows)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[getattr(model, key)],
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in ("units", "revenue", "purchases")}
+        ))
+        return
+    column = getattr(model, key)
+    for row in rows:
+        result = db.execute(
+            update(model).where(column == row[key])
+            .values(units=model.units + row["units"], revenue=model.revenue + row["revenue"],
+                    purchases=model.purchases + row["purchases"])
+            .execution_options(synchronize_session=False)
+        )
+        if not result.rowcount:
+            db.execute(insert(model).values(**row))
+
+def record(db: Session, added=(), removed=()):
+    # added purchases count in, removed ones (deleted, or the old side of an
+    # update) count out; all of it is netted into one upsert per table. The
+    # caller commits.
+    by_product, by_user, by_day = {}, {}, {}
+    changes = [(1, purchase) for purchase in added] + [(-1, purchase) for purchase in removed]
+    for sign, (user_id, product_id, created_at, quantity, revenue) in changes:
+        delta = (sign * (quantity if quantity is not None else 1), sign * (revenue or 0), sign)
+        for deltas, value in ((by_product, product_id), (by_user, user_id), (by_day, _day(created_at))):
+            if value is None:
+                continue
+            totals = deltas.setdefault(value, [0, 0, 0])
+            for i, amount in enumerate(delta):
+                totals[i] += amount
+    _upsert(db, models.ProductSales, "product_id", by_product)
+    _upsert(db, models.UserSales, "user_id", by_user)
+    _upsert(db, models.DailySales, "day", by_day)
+
+def recompute(conn):
+    # replaces every aggregate with a GROUP BY over PURCHASE; runs on a
+    # Session or a Connection inside the caller's transaction
+    purchase = models.Purchase
+    units = func.sum(func.coalesce(purchase.quantity, 1))
+    revenue = func.sum(func.coalesce(purchase.total_price, 0))
+    count = func.count(purchase.id)
+    day = func.date(purchase.created_at)
+    sources = [
+        (models.ProductSales, "product_id",
+         select(purchase.product_id, units, revenue, count).where(purchase.product_id.isnot(None))
+         .group_by(purchase.product_id)),
+        (models.UserSales, "user_id",
+         select(purchase.user_id, units, revenue, count).where(purchase.user_id.isnot(None))
+         .group_by(purchase.user_id)),
+        (models.DailySales, "day",
+         select(day, units, revenue, count).where(purchase.created_at.isnot(None)).group_by(day)),
+    ]
+    for model, key, query in sources:
+        conn.execute(delete(model))
+        conn.execute(insert(model).from_select([key, "units", "revenue", "purchases"], query))
+
+def rebuild(db: Session):
+    try:
+        recompute(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info("Sales aggregates rebuilt")
+
+def top_sellers(db: Session, limit: int = 10, by: str = "revenue"):
+    order = models.ProductSales.units if by == "units" else models.ProductSales.revenue
+    return (
+        db.query(models.ProductSales.product_id, models.ProductSales.units,
+                 models.ProductSales.revenue, models.ProductSales.purchases)
+        .order_by(order.desc(), models.ProductSales.product_id)
+        .limit(limit)
+        .all()
+    )
+
+def lifetime_spend(db: Session, user_id: int):
+    row = (
+        db.query(models.UserSales.units, models.UserSales.revenue, models.UserSales.purchases)
+        .filter(models.UserSales.user_id == user_id)
+        .first()
+    )
+    units, revenue, purchases = row or (0, 0.0, 0)
+    return {"user_id": user_id, "units": units, "revenue": revenue, "purchases": purchases}
+
+def daily(db: Session, start: date | None = None, end: date | None = None, limit: int = 31):
+    query = db.query(models.DailySales.day, models.DailySales.units,
+                     models.DailySales.revenue, models.DailySales.purchases)
+    if start is not None:
+        query = query.filter(models.DailySales.day >= start)
+    if end is not None:
+        query = query.filter(models.DailySales.day <= end)
+    return query.order_by(models.DailySales.day.desc()).limit(limit).all()
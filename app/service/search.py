@@ -0,0 +1,89 @@
+from sqlalchemy import text, or_
+from sqlalchemy.orm import Session
+import Models.models as models
+from service.pagination import encode_score_cursor, decode_score_cursor
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ranked product search. SQLite uses an external-content FTS5 table and
+# Postgres a generated tsvector column; both are created by migration 0003 and
+# kept in sync by the database itself (triggers / generated column), so every
+# write path, including bulk upserts, is covered. Lower score ranks first.
+#
+# Scoring every match and sorting them costs as much as the match count: a
+# short prefix such as "la" matches most of a large catalog. Only the first
+# SEARCH_CANDIDATES matches in index order are scored and ranked, and keyset
+# pages rank the same window again, so a query's cost is bounded whatever it
+# matches. Broad queries are ranked within that window; more terms narrow it.
+
+max_terms = 8
+candidates = int(os.getenv('SEARCH_CANDIDATES', 1000))
+
+def search_terms(q: str):
+    return re.findall(r"\w+", q.lower())[:max_terms]
+
+def sqlite_statement(keyset: bool):
+    # bm25() is computed in the subquery, so only the LIMITed rows are scored
+    inner = (
+        'SELECT p.id, p.name, p.description, p.price, p.stock, c.score '
+        'FROM (SELECT rowid, bm25(products_fts, 10.0, 1.0) AS score FROM products_fts '
+        'WHERE products_fts MATCH :match LIMIT :candidates) c '
+        'JOIN "PRODUCTSTABLE" p ON p.id = c.rowid'
+    )
+    return ranked_statement(inner, keyset)
+
+def postgres_statement(keyset: bool):
+    inner = (
+        'SELECT p.id, p.name, p.description, p.price, p.stock, '
+        '-ts_rank(p.search_vector, to_tsquery(\'simple\', :match)) AS score '
+        'FROM "PRODUCTSTABLE" p '
+        'WHERE p.search_vector @@ to_tsquery(\'simple\', :match) LIMIT :candidates'
+    )
+    return ranked_statement(inner, keyset)
+
+def ranked_statement(inner: str, keyset: bool):
+    where = " WHERE s.score > :score OR (s.score = :score AND s.id > :last_id)" if keyset else ""
+    return text(f"SELECT * FROM ({inner}) s{where} ORDER BY s.score, s.id LIMIT :limit")
+
+def search_products(db: Session, q: str, limit: int = 20, cursor: str | None = None):
+    after = decode_score_cursor(cursor)
+    terms = search_terms(q)
+    if not terms:
+        return [], None
+    dialect = db.get_bind().dialect.name
+    params = {"limit": limit + 1, "candidates": candidates}
+    if after is not None:
+        params["score"], params["last_id"] = after
+    if dialect == "sqlite":
+        params["match"] = " AND ".join(f'"{term}"*' for term in terms)
+        rows = db.execute(sqlite_statement(after is not None), params).mappings().all()
+    elif dialect == "postgresql":
+        params["match"] = " & ".join(f"{term}:*" for term in terms)
+        rows = db.execute(postgres_statement(after is not None), params).mappings().all()
+    else:
+        return like_search(db, terms, limit, cursor)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_score_cursor(rows[-1]["score"], rows[-1]["id"])
+    logger.info("Search for %r returned %s products", q, len(rows))
+    return [dict(row) for row in rows], next_cursor
+
+def like_search(db: Session, terms: list[str], limit: int, cursor: str | None):
+    # unranked fallback for dialects without full-text support
+    after = decode_score_cursor(cursor)
+    query = db.query(models.Product)
+    for term in terms:
+        pattern = f"%{term}%"
+        query = query.filter(or_(models.Product.name.ilike(pattern), models.Product.description.ilike(pattern)))
+    if after is not None:
+        query = query.filter(models.Product.id > after[1])
+    rows = query.order_by(models.Product.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_score_cursor(0.0, rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,42 @@
+from pydantic import BaseModel
+import orjson
+
+# Fast path for list responses. Rows come straight from column tuples, are
+# laid out in the schema's field order with the schema's scalar types, and
+# are encoded with orjson. The bytes match what response_model produced
+# (compact separators, UTF-8, same key order), but no ORM instance or
+# Pydantic model is built per row. The per-schema layout is computed once.
+
+def _float(value):
+    return None if value is None else float(value)
+
+def _int(value):
+    return None if value is None else int(value)
+
+_coercers = {float: _float, int: _int}
+
+class RowSerializer:
+    def __init__(self, schema: type[BaseModel]):
+        self.schema = schema
+        self.fields = list(schema.model_fields)
+        self.coercers = [_coercers.get(info.annotation) for info in schema.model_fields.values()]
+
+    def columns(self, model):
+        return [getattr(model, name) for name in self.fields]
+
+    def row(self, row):
+        return {
+            name: (coerce(value) if coerce is not None else value)
+            for name, coerce, value in zip(self.fields, self.coercers, row)
+        }
+
+    def dump_page(self, rows, next_cursor: str | None):
+        return orjson.dumps({"items": [self.row(row) for row in rows], "next_cursor": next_cursor})
+
+_serializers = {}
+
+def for_schema(schema: type[BaseModel]):
+    serializer = _serializers.get(schema)
+    if serializer is None:
+        serializer = _serializers[schema] = RowSerializer(schema)
+    return serializer
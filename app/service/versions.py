@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+import hashlib
+import math
+import time
+import Models.models as models
+import service.sales as sales
+
+# Version counters for conditional GETs, one RESOURCE_VERSIONS row per key
+# ("catalog", "purchases:<user_id>"). crud write functions bump the key they
+# change inside their own transaction, so a counter commits together with
+# the data it describes and every worker reads the same value. List
+# endpoints read the counter in the session that then reads the body, one
+# primary key lookup, and answer If-None-Match / If-Modified-Since without
+# running the listing query. A key that was never bumped is version 0.
+#
+# HTTP dates have one-second resolution. Last-Modified is the first whole
+# second after the modification, and is only sent once that second has
+# started, so a write after the response always compares as newer. An
+# If-Modified-Since date gets a 304 only if the modification is strictly
+# older than it.
+
+def bump(db: Session, key: str):
+    # the caller commits
+    table = models.ResourceVersion.__table__
+    now = sales.utcnow()
+    dialect_insert = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table).values(key=key, version=1, modified_at=now)
+        db.execute(stmt.on_conflict_do_update(index_elements=[table.c.key],
+                                              set_={"version": table.c.version + 1, "modified_at": now}))
+        return
+    result = db.execute(update(table).where(table.c.key == key).values(version=table.c.version + 1, modified_at=now))
+    if not result.rowcount:
+        db.execute(insert(table).values(key=key, version=1, modified_at=now))
+
+def get(db: Session, key: str):
+    # returns (version, unix time of the last bump or None)
+    table = models.ResourceVersion.__table__
+    row = db.execute(select(table.c.version, table.c.modified_at).where(table.c.key == key)).first()
+    if row is None:
+        return 0, None
+    return row.version, row.modified_at.replace(tzinfo=timezone.utc).timestamp()
+
+def make_etag(key: str, version: int, modified: float | None, *params):
+    # the bump time keeps ETags from a recreated database from matching
+    digest = hashlib.blake2b(repr((key, version, modified, params)).encode(), digest_size=8).hexdigest()
+    return f'W/"{version}-{digest}"'
+
+def headers_for(key: str, version: int, modified: float | None, *params):
+    headers = {"ETag": make_etag(key, version, modified, *params), "Cache-Control": "no-cache"}
+    if modified is not None:
+        last_modified = math.floor(modified) + 1
+        if last_modified <= time.time():
+            headers["Last-Modified"] = format_datetime(datetime.fromtimestamp(last_modified, timezone.utc), usegmt=True)
+    return headers
+
+def not_modified(headers: dict, modified: float | None, if_none_match: str | None, if_modified_since: str | None):
+    if if_none_match is not None:
+        etag = headers["ETag"].removeprefix("W/")
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if if_modified_since is not None and modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return modified < since.timestamp()
+    return False
+
+def conditional(db: Session, key: str, params: tuple, if_none_match: str | None, if_modified_since: str | None):
+    # returns the version, its validator headers and whether the request can get a 304
+    version, modified = get(db, key)
+    headers = headers_for(key, version, modified, *params)
+    return version, headers, not_modified(headers, modified, if_none_match, if_modified_since)